@@ -6,6 +6,8 @@ from aiogram.types.callback_query import CallbackQuery
 
 from Bot.P_states import NormalCall
 
+SEARCH_STAGES = ('links', 'boards', 'reduced', 'hashtags')  # stages of search, which results are checkpointed
+
 
 class ContentFilterHandler:
     """Look core.content_filter for more details"""
@@ -198,6 +200,11 @@ class FSMManager:
         nested_save = await self.generate_state_key({'tags': tags})
         self.buffer.update(nested_save)
 
+    async def save_checkpoint(self, checkpoint: dict) -> None:
+        """writes checkpoint of search to storage at once, bypassing buffer,
+        so it survives errors and restarts happened later"""
+        await self.state.update_data({'search_checkpoint': checkpoint})
+
     def update_last_capture(self, new_capture: dict) -> None:
         """changes value of 'current capture' key in buffer"""
         self.buffer.update({'current_capture': new_capture})
@@ -249,6 +256,9 @@ class FSMManager:
         """cleans storage and buffer"""
         # part of data in aiogram proxy must be keeped between rounds of file handling
         # or shoudnt if flags sets off
+        # storage is read again: manager may be created without data, and checkpoint of search
+        # is written to storage directly, so data taken before is outdated
+        await self.get_current_data()
         self.buffer.clear()
         eraser = {}
         if self.data_storage:
@@ -256,6 +266,9 @@ class FSMManager:
                 eraser.update({'sfw_flag': True})
             if 'ac_flag' in self.data_storage:
                 eraser.update({'ac_flag': True})
+            checkpoint = self.data_storage.get('search_checkpoint')
+            if checkpoint and checkpoint['stage'] != SEARCH_STAGES[-1]:  # unfinished search can be resumed
+                eraser.update({'search_checkpoint': checkpoint})
             self.data_storage.clear()
         await self.state.set_data(eraser)
 
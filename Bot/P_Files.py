@@ -5,9 +5,11 @@ from io import BytesIO
 from typing import Union
 
 from aiogram.types import Message
+from aiogram.utils.exceptions import FileIsTooBig
 
 from Bot.bot_functions import Pandora
-from image_check import is_pic_already_posted_check
+from image_check import async_is_clip_already_posted_check, async_is_file_already_posted_check, \
+    async_is_pic_already_posted_check, file_digest
 
 """ This code is designed to provide a flexible and extensible framework 
 for working with different types of files in a chatbot, 
@@ -33,6 +35,7 @@ class BotFile:
     - file_type: the type of file (always FileType.PHOTO)
     - message_id: id of incoming message with file
     - file_id: id of incoming file
+    - file_unique_id: id of incoming file, which is the same for all its forwards and re-sends
     - prewiew_id: id of file prewiew
     - size: width and height of file in tuple
     - src: path to locally saved temporary copy
@@ -43,6 +46,7 @@ class BotFile:
     file_type: FileType = FileType.PHOTO
     message_id: typing.Optional[str] = None
     file_id: typing.Optional[str] = None
+    file_unique_id: typing.Optional[str] = None
     prewiew_id: typing.Optional[str] = None
     size: typing.Optional[tuple] = None
     src: typing.Optional[str] = None
@@ -151,6 +155,7 @@ class PhotoFileFactory(FileFactory):
     def get_photo_id(self) -> None:
         """stores file id in class arg"""
         self.photo.file_id = self.message.photo[-1].file_id
+        self.photo.file_unique_id = self.message.photo[-1].file_unique_id
 
     @property
     def download_id(self):
@@ -204,6 +209,7 @@ class AnimationFileFactory(FileFactory):
     def get_animation_id(self) -> None:
         """stores file id in class arg"""
         self.animation.file_id = self.message.animation.file_id
+        self.animation.file_unique_id = self.message.animation.file_unique_id
 
     def gather_info(self) -> None:
         """
@@ -259,6 +265,7 @@ class VideoFileFactory(FileFactory):
         Retrieves the ID of the video and stores it in the file_id property of the associated Video object.
         """
         self.video.file_id = self.message.video.file_id
+        self.video.file_unique_id = self.message.video.file_unique_id
 
     def gather_info(self) -> None:
         """
@@ -302,15 +309,38 @@ class TelegrammFileHandler:
         downloaded = await self.bot.download_file(file_path=prepared.file_path)
         return downloaded
 
-    async def prepare_file(self) -> None:
-        """stores information about file into file object"""
+    async def prepare_file(self, check_posted: bool = True) -> None:
+        """stores information about file into file object. \n
+        If check_posted, file searched in posts by its file_unique_id first, and isn't downloaded
+        if it was already posted: forwards and re-sends are the most common duplicates"""
         self.file_type_assign()
         self.factory.gather_info()
+        if check_posted and (check_result := await async_is_file_already_posted_check(
+                self.factory.file.file_unique_id)):
+            self.is_already_posted = check_result
+            return
         self.factory.file.bytes = await self.open_user_file(self.factory.download_id)
 
+    async def clip_posted_check(self) -> Union[str, bool]:
+        """searching for animations and videos with similar sampled frames. Clip downloaded only here,
+        other steps use its prewiew"""
+        try:
+            clip = await self.open_user_file(self.factory.file.file_id)
+        except FileIsTooBig:  # bot api doesn't give files over 20 mb, so only prewiew can be checked
+            return False
+        return await async_is_clip_already_posted_check(clip)
+
     async def already_posted_check(self) -> None:
-        """searching for similar images in saved thumbnails"""
-        if check_result := is_pic_already_posted_check(self.factory.file.bytes):
+        """searching for the same file by SHA-256 of its content, then for similar images in saved thumbnails,
+        for animations and videos searching for similar clips before thumbnails"""
+        if self.is_already_posted:  # found by file_unique_id before download
+            return
+        digest = file_digest(self.factory.file.bytes.getvalue())
+        if check_result := await async_is_file_already_posted_check(digest):
+            self.is_already_posted = check_result
+        elif self.file_type != FileType.PHOTO and (check_result := await self.clip_posted_check()):
+            self.is_already_posted = check_result
+        elif check_result := await async_is_pic_already_posted_check(self.factory.file.bytes):
             self.is_already_posted = check_result
 
     def aldeady_posted_reply(self) -> None:
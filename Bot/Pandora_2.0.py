@@ -25,7 +25,11 @@ from Bot.error_handlers import CustomErrorHandler
 from Bot.new_file_from_user import NewIncomingFile
 from Bot.repost_handler import RepostToChannel
 from core.exceptions import ApplyThreeReactionsKeyboard, NoContentAtNAOPage, NoSimilarPics, CustomError, SearchFailure, SpecialContent
+from core.http_clients import http_clients
+from core.nao_scheduler import nao_scheduler
+from image_check import load_hash_indexes
 from llikes_dispathcer import LikesKeyboardsHandler
+from parsers.imageboards_parsers import parse_pool, pixiv_session
 from parsers.yandex_parser import YandexParser
 
 client = MongoClient(os.environ['HOST'], 'YOUR IP ADRESS HERE')
@@ -65,12 +69,22 @@ async def cancel(message: Message, state: FSMContext):
     Sends user notification.
     Sets bot into initial state"""
     manager = fsm.FSMManager(state)
+    await manager.get_current_data()
     if manager.data_storage:
         await manager.flush()
     await message.answer('waiting for file')
     await NormalCall.waiting_for_pic.set()
 
 
+@dp.message_handler(commands='nao_stats', state='*')
+async def nao_stats(message: Message, state: FSMContext):  # state instace isnt used but still comes to handler
+    """Service command for admins (ids in ADMIN_IDS, separated by commas): shows remaining quota,
+    count of searches and rejections and time left on bench for every Sauce NAO key"""
+    if str(message.from_user.id) not in os.environ.get('ADMIN_IDS', '').split(','):
+        return
+    await message.answer(nao_scheduler.metrics_report())
+
+
 @dp.message_handler(commands='sfw', state='*')
 async def sfw_flag(message: Message, state: FSMContext):  # message instace isnt used but still comes to handler
     """
@@ -459,11 +473,21 @@ async def repost_inline_handler(inline_query: types.InlineQuery, state: FSMConte
     await repost_command.create_post()
 
 
+async def startup(dispatcher: Dispatcher):
+    """loads packed archives of posted pictures and opens http clients, so first user dont wait for it"""
+    load_hash_indexes()
+    await http_clients.async_start(prewarm=True)
+    print('started!')
+
+
 async def shutdown(dispatcher: Dispatcher):
-    """disconnects bot from storage"""
+    """disconnects bot from storage, closes http clients and pixiv session and stops parsing processes"""
+    await http_clients.async_close()
+    await pixiv_session.async_close()
+    parse_pool.close()
     await dispatcher.storage.close()
     await dispatcher.storage.wait_closed()
 
 
 if __name__ == "__main__":
-    executor.start_polling(dp, on_startup=print('started!'), on_shutdown=shutdown)
+    executor.start_polling(dp, on_startup=startup, on_shutdown=shutdown)
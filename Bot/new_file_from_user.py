@@ -1,23 +1,31 @@
 from __future__ import annotations
 
-from typing import Iterable, Coroutine
+import asyncio
+import copy
+from typing import Iterable, Coroutine, Optional
 
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 
 from bot_functions import Pandora
-from Bot.FSM_manager import FSMManager
+from Bot.FSM_manager import FSMManager, SEARCH_STAGES
 from Bot.P_Files import TelegrammFileHandler
 from Bot.P_states import NormalCall
 from Bot.keyboards import menu_keyboards
 from core import exceptions
+from core.nao_scheduler import nao_scheduler
 from core.reducer import ParsedInfoReducer
-from core.reverse_image_search import search_for_sources
+from core.resizer import downscale_for_search
+from core.reverse_image_search import async_search_for_sources
+from core.search_cache import search_cache
 from core.string_collector import StringCollector
 from core.tag_generator import TagGeneratorHandler
-from parsers.imageboards_parsers import parse_imageboards
+from parsers.imageboards_parsers import merge_board_tags, parse_boards
+from parsers.sause_nao_operations import SauseNaoParser
 from parsers.validator import ReprForLinksSearch
 
+NOTICE_WAIT = 10  # seconds, if search waits in queue of Sauce NAO longer, user is notified
+
 
 # General structure of events happens:
 # > user sends file
@@ -30,6 +38,8 @@ from parsers.validator import ReprForLinksSearch
 # Non-general cases:
 # 1 file was gif or mp4 - user got message asking if user want search for sourses anyway
 # 2 SauseNao search failed - selenium started, trying to get links to imageboards with yandex reverse search
+# Results of every stage (links, tags from every imageboard, reduced tags, hashtags) are checkpointed in storage.
+# If search of the same file failed before, it resumes from first unfinished stage
 
 
 class NewIncomingFile:
@@ -43,6 +53,9 @@ class NewIncomingFile:
         self.state: FSMContext = state
         self.manager: FSMManager = manager
         self.file_handler = file_handler
+        self.cache_key: Optional[dict] = None  # hashes of incoming picture, its key in cache of reverse search results
+        self.cached_tags: Optional[dict] = None
+        self.checkpoint: Optional[dict] = None  # results of finished stages of search, see load_checkpoint
 
     async def process_preliminary_file_handle(self, message):
         """creates TelegrammFileHandler instance and assigns its args by data from message"""
@@ -57,14 +70,64 @@ class NewIncomingFile:
             raise exceptions.PictureAlreadyPosted(self.file_handler.is_already_posted)
         await self.manager.save_to_proxy()
 
-    def process_reverse_search(self) -> tuple[dict, Iterable[str | None]]:
+    async def process_reverse_search(self) -> tuple[dict, Iterable[str | None]]:
         """passes bytes of incoming file or its prewiew to reverse search SauceNAO parser
-        in core.reverse_image_search"""
-        links, artist = search_for_sources(self.file_handler.factory.file.bytes.getvalue(), self.bot.yandex_parser)
+        in core.reverse_image_search. If the same picture was searched before, result is taken from cache"""
+        file_bytes = self.file_handler.factory.file.bytes.getvalue()
         # somehow BytesIO from aiogram doesent reads be requests library methods with some types of previews
         # as it is. Adding getvalue() to BytesIO fixes this
+        self.cache_key = await search_cache.async_key(file_bytes)
+        if cached := await search_cache.async_get(self.cache_key):
+            self.cache_key = search_cache.cached_hashes(cached)  # tags found later are added to the same result
+            return self.restore_saved_search(cached)
+        user_id = self.message.from_user.id
+        if (wait := nao_scheduler.expected_wait(user_id)) > NOTICE_WAIT:
+            await self.bot.send_message(user_id, f'Sauce NAO is busy, search starts in about {int(wait)} seconds')
+        upload = await asyncio.get_running_loop().run_in_executor(None, downscale_for_search, file_bytes)
+        links, artist = await async_search_for_sources(upload, self.bot.yandex_parser, user_id)
+        artist = list(artist)
+        await search_cache.async_put(self.cache_key, links=list(links.items()), artists=artist,
+                                     redirect=self.bot.yandex_parser.url)
         return links, artist
 
+    def restore_saved_search(self, saved: dict) -> tuple[dict, Iterable[str | None]]:
+        """returns links and artists from cached search result or checkpoint, prepares yandex parser
+        the same way real search does, so redirected search still works"""
+        # imageboard names contain dots, which are not welcome in keys of mongo documents, so stored as pairs
+        links = dict(saved['links'])
+        self.bot.yandex_parser.parser = SauseNaoParser(None, None, links)
+        self.bot.yandex_parser.url = saved.get('redirect')
+        self.cached_tags = saved.get('tags')
+        return links, saved['artists']
+
+    def load_checkpoint(self) -> None:
+        """takes checkpoint of previous search of the same file from storage, or starts new one. \n
+        Checkpoint is dict with id of file ('file'), last finished stage ('stage') and results of finished stages"""
+        if self.file_handler is None:
+            return
+        file_id = self.file_handler.factory.file.file_unique_id
+        checkpoint = self.manager.data_storage.get('search_checkpoint')
+        if checkpoint and checkpoint['file'] == file_id:
+            self.checkpoint = checkpoint
+        else:
+            self.checkpoint = {'file': file_id, 'stage': None}
+
+    def checkpoint_reached(self, stage: str) -> bool:
+        """checks if stage of search was finished before"""
+        if self.checkpoint is None or self.checkpoint['stage'] is None:
+            return False
+        return SEARCH_STAGES.index(self.checkpoint['stage']) >= SEARCH_STAGES.index(stage)
+
+    async def save_checkpoint(self, stage: Optional[str], **results) -> None:
+        """adds results of stage to checkpoint and writes it to storage.
+        Searches without file (redirected to yandex) aren't checkpointed"""
+        if self.checkpoint is None:
+            return
+        self.checkpoint.update(results)
+        if stage is not None:
+            self.checkpoint['stage'] = stage
+        await self.manager.save_checkpoint(self.checkpoint)
+
     async def source_found_reply(self) -> None:
         """sends user notification of reverse image search succed as message"""
         user_id = None
@@ -79,25 +142,53 @@ class NewIncomingFile:
         await self.bot.send_message(user_id, 'souce found!')
 
     async def gather_info_from_imageboards(self, search_result: dict, artists_result: Iterable[str | None]) -> dict:
-        """parse imageboard for picture descriptions tags with parsers.imageboards_parsers"""
-        pre_reduced = await parse_imageboards(search_result)
+        """parse imageboard for picture descriptions tags with parsers.imageboards_parsers,
+        or takes them from cached search result"""
+        if self.cached_tags is not None:
+            pre_reduced = copy.deepcopy(self.cached_tags)
+        elif self.checkpoint_reached('reduced'):  # failed imageboards aren't parsed again, search resumes after reduce
+            pre_reduced = merge_board_tags(dict(self.checkpoint.get('boards', [])))
+        else:
+            pre_reduced, complete = await self.parse_imageboards(search_result)
+            if self.cache_key is not None and complete:  # tags without dropped imageboards aren't cached
+                await search_cache.async_put(self.cache_key, tags=pre_reduced)
         pre_reduced['artist'].append(artists_result)
         if not any([x for x in pre_reduced['tags'] if x != ['']]):
             raise exceptions.UnsuccefulParsing
         await self.state_group.next()
         return pre_reduced
 
+    async def parse_imageboards(self, search_result: dict) -> tuple[dict, bool]:
+        """parses imageboards, which weren't parsed by previous attempts, checkpoints tags from every
+        parsed imageboard. Failed imageboards are dropped, search goes on with the rest of them.
+        If all imageboards failed, error is rised after checkpoint is saved, so next attempt parses them again. \n
+        Returns tags and flag, whether all imageboards were parsed"""
+        parsed = dict(self.checkpoint.get('boards', [])) if self.checkpoint else None
+        boards, errors = await parse_boards(search_result, parsed)
+        await self.save_checkpoint('boards' if boards else None, boards=list(boards.items()))
+        if errors and not boards:
+            raise errors[0]
+        return merge_board_tags(boards), not errors
+
     async def process_reduce(self, pic_parsed_info: dict) -> dict:
         """shrincs parsed tags in flat lists of categhories"""
         await self.state_group.next()
+        if self.checkpoint_reached('reduced'):
+            return self.checkpoint['reduced']
         red = ParsedInfoReducer()
-        return red.reduce_all(pic_parsed_info)
+        reduced = red.reduce_all(pic_parsed_info)
+        await self.save_checkpoint('reduced', reduced=reduced)
+        return reduced
 
     async def generate_hashtags(self, pic_parsed_info) -> dict:
         """transform reduced tags into telegramm's hastags using bot's db"""
-        tag_gen = TagGeneratorHandler(parsed_tags=pic_parsed_info, filter_value='standart')
         await self.state_group.next()
-        return tag_gen.recognize_and_generate_hasttags()
+        if self.checkpoint_reached('hashtags'):
+            return copy.deepcopy(self.checkpoint['hashtags'])
+        tag_gen = TagGeneratorHandler(parsed_tags=pic_parsed_info, filter_value='standart')
+        hashtags = tag_gen.recognize_and_generate_hasttags()
+        await self.save_checkpoint('hashtags', hashtags=copy.deepcopy(hashtags))
+        return hashtags
 
     @staticmethod
     def generate_capture(generated_hastags: dict) -> str:
@@ -137,9 +228,16 @@ class NewIncomingFile:
         await self.manager.save_to_proxy()
 
     async def reverse_search(self) -> tuple[dict, Iterable[str | None]]:
-        """performs reverise image search with parsers.sause_nao_operations"""
+        """performs reverise image search with parsers.sause_nao_operations,
+        or takes its result from checkpoint of previous search of the same file"""
         self.carnaval_flag()  # if flag is set, rises error and skips reverse search part
-        links_to_user_picture, artists = self.process_reverse_search()
+        self.load_checkpoint()
+        if self.checkpoint_reached('links'):
+            links_to_user_picture, artists = self.restore_saved_search(self.checkpoint)
+        else:
+            links_to_user_picture, artists = await self.process_reverse_search()
+            await self.save_checkpoint('links', links=list(links_to_user_picture.items()), artists=list(artists),
+                                      redirect=self.bot.yandex_parser.url)
         await self.state_group.next()
         return links_to_user_picture, artists
 
@@ -151,9 +249,8 @@ class NewIncomingFile:
         """parses imageboards for description tags, saves result to buffer"""
         pic_desc = await self.gather_info_from_imageboards(links_to_picture, artists)
         await self.manager.save_to_buffer_under_state_key(pic_desc)  # point of saving it to buffer is what proxy can be
-        # disconnected and parsing imagegeboards will fail. So dont saving this result to proxy can possibly allow
-        # to resume search without consuming extra request to Souse Nao.  However methods for resume
-        # search not implemented yet
+        # disconnected and parsing imagegeboards will fail. Search itself is resumed from checkpoint,
+        # see load_checkpoint
         return pic_desc
 
     def carnaval_flag(self):
@@ -218,7 +315,7 @@ class NewIncomingFile:
         await self.manager.get_current_data()
         self.file_handler = TelegrammFileHandler(message=self.message.message.reply_to_message,
                                                  bot=self.bot)
-        await self.file_handler.prepare_file()
+        await self.file_handler.prepare_file(check_posted=False)  # file is needed for search anyway
         links, artists = await self.reverse_search()
         capture = await self.from_link_to_capture_process(links, artists)
         await self.manager.save_to_proxy()
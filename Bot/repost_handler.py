@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from dataclasses import dataclass, field
 from io import BytesIO
 
@@ -7,6 +8,7 @@ import motor.motor_asyncio as async_motor
 from aiogram.dispatcher import FSMContext
 from aiogram.types import InlineQueryResultCachedPhoto, \
     InlineQueryResultCachedGif, InlineQueryResultCachedVideo, InlineQuery, InlineQueryResult
+from aiogram.utils.exceptions import FileIsTooBig
 
 from Bot.bot_functions import Pandora
 from Bot.FSM_manager import FSMManager
@@ -14,7 +16,9 @@ from Bot.P_Files import FileType
 from Bot.P_states import NormalCall
 from Bot.keyboards.likes_keyboards import LikeKeyboard
 from core.resizer import PhotoResise
+from core.video_fingerprint import clip_fingerprint, fingerprint_to_hex
 from core.string_collector import StringCollector
+from image_check import file_digest, picture_hashes
 
 
 client = async_motor.AsyncIOMotorClient('localhost', 27017)
@@ -42,6 +46,17 @@ class PrepareResize:
         downloaded = await self.bot.download_file(file_path=prepared.file_path)
         return downloaded
 
+    async def clip_fingerprint(self) -> str | None:
+        """Downloads animation or video itself and returns packed hashes of its sampled frames"""
+        file_info = self.proxy_data['NormalCall:waiting_for_pic']
+        try:
+            prepared = await self.bot.get_file(file_id=file_info['file_id'])
+        except FileIsTooBig:
+            return None
+        clip = await self.bot.download_file(file_path=prepared.file_path)
+        frames = await asyncio.get_running_loop().run_in_executor(None, clip_fingerprint, clip)
+        return fingerprint_to_hex(frames) if frames else None
+
     async def build_resize_info(self) -> tuple[int, BytesIO, tuple]:
         """Gather necessary args for resizing from aiogram storage"""
         file_info = self.proxy_data['NormalCall:waiting_for_pic']
@@ -223,7 +238,7 @@ class RepostToChannel:
     async def prepare_file_info_save(self) -> None:
         """
         Gathers all data for creating new post and such as file size, file id, etc.
-        Creates resized kopy of file locally.
+        Creates resized kopy of file locally and computes its hashes.
         Saves gathered data to buffer.
         :return: None
         """
@@ -235,6 +250,19 @@ class RepostToChannel:
         saved_thumbnail_src = resizer.resize_and_save()
         prepared_for_compression = self.file_info_to_list(file_info, saved_thumbnail_src)
         self.save_file_info_to_buffer(prepared_for_compression)
+        loop = asyncio.get_running_loop()  # hashing and digest run in executor, so other users aren't blocked
+        content = resize_preparer.fbytes.getvalue()
+        hashes, digest = await asyncio.gather(loop.run_in_executor(None, picture_hashes, saved_thumbnail_src),
+                                              loop.run_in_executor(None, file_digest, content))
+        self.manager.buffer.update(hashes)  # so duplicate checks
+        # compare hashes only and never open this thumbnail again
+        self.manager.buffer.update({  # exact keys of posted file, so its forwards and re-sends are found instantly
+            'file_unique_id': self.manager.data_storage['NormalCall:waiting_for_pic'].get('file_unique_id'),
+            'sha256': digest,
+        })
+        if resize_preparer.file_type != FileType.PHOTO.value:
+            if frames := await resize_preparer.clip_fingerprint():
+                self.manager.buffer['frames'] = frames  # hashes of sampled frames for similar clips search
 
     async def write_file_as_posted(self) -> str:
         """
@@ -23,6 +23,13 @@ class ErrorConnectToNAO(CustomError):
         super(CustomError, self).__init__(message)
 
 
+class NAOQuotaExhausted(CustomError):
+    """Raised when search quota of SauceNAO is spent and won't be restored soon"""
+    def __init__(self):
+        message = 'SauceNAO search limit reached, try later'
+        super(NAOQuotaExhausted, self).__init__(message)
+
+
 class NoContentAtNAOPage(SpecialError):
     """Raised when there is no suitable content found on the SauceNAO page"""
     def __init__(self):
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from itertools import combinations
+from typing import Any, Iterator, Sequence
+
+import numpy as np
+
+"""Structures for search of near-duplicate pictures by Hamming distance between their perceptual hashes"""
+
+_m1 = np.uint64(0x5555555555555555)
+_m2 = np.uint64(0x3333333333333333)
+_m4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_h01 = np.uint64(0x0101010101010101)
+
+
+def popcount64(words: np.ndarray) -> np.ndarray:
+    """Counts set bits in every element of uint64 array. Array may be overwritten"""
+    if hasattr(np, 'bitwise_count'):  # numpy 2 has native popcount
+        return np.bitwise_count(words)
+    words -= (words >> np.uint64(1)) & _m1
+    words[...] = (words & _m2) + ((words >> np.uint64(2)) & _m2)
+    words += words >> np.uint64(4)
+    words &= _m4
+    words *= _h01
+    words >>= np.uint64(56)
+    return words
+
+
+class MultiIndexHash:
+    """
+    Index of hashes, which returns all stored hashes within given Hamming distance from query.
+
+    Hash splits into several parts (chunks), each part is a key in its own table.
+    If two hashes differ at most in `radius` bits, at least one pair of their parts
+    differs at most in `radius // chunks` bits (pigeonhole principle),
+    so search looks only into neighbours of query parts instead of scanning whole archive.
+
+    - bits: length of stored hashes in bits
+    - chunks: count of parts hash splits into
+    """
+
+    def __init__(self, bits: int, chunks: int):
+        self.bits = bits
+        self.chunks = chunks
+        self._bounds = [(bits * i // chunks, bits * (i + 1) // chunks) for i in range(chunks)]
+        self._tables: list[defaultdict[int, list[int]]] = [defaultdict(list) for _ in range(chunks)]
+        self._hashes: list[int] = []
+        self._payloads: list[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def split(self, value: int) -> list[int]:
+        """Cuts hash into parts, used as keys of tables"""
+        return [(value >> start) & ((1 << (end - start)) - 1) for start, end in self._bounds]
+
+    def add(self, value: int, payload: Any) -> None:
+        """Stores hash with payload (usually id of post) in index"""
+        position = len(self._hashes)
+        self._hashes.append(value)
+        self._payloads.append(payload)
+        for table, part in zip(self._tables, self.split(value)):
+            table[part].append(position)
+
+    @staticmethod
+    def neighbours(part: int, width: int, radius: int) -> Iterator[int]:
+        """Yields all values of part with at most `radius` flipped bits"""
+        yield part
+        for distance in range(1, radius + 1):
+            for positions in combinations(range(width), distance):
+                flipped = part
+                for position in positions:
+                    flipped ^= 1 << position
+                yield flipped
+
+    def candidates(self, value: int, radius: int) -> set[int]:
+        """Returns positions of hashes, which have at least one part close enough to part of query"""
+        part_radius = radius // self.chunks
+        found = set()
+        for (start, end), table, part in zip(self._bounds, self._tables, self.split(value)):
+            for key in self.neighbours(part, end - start, part_radius):
+                found.update(table.get(key, ()))
+        return found
+
+    def search(self, value: int, radius: int) -> list[tuple[int, Any]]:
+        """Returns (distance, payload) of all stored hashes within radius, closest first"""
+        matches = []
+        for position in self.candidates(value, radius):
+            distance = (value ^ self._hashes[position]).bit_count()
+            if distance <= radius:
+                matches.append((distance, self._payloads[position]))
+        return sorted(matches, key=lambda x: x[0])
+
+
+class HashMatrix:
+    """
+    All stored hashes packed in uint64 matrix for brute force search:
+    distances from query to every hash computed in vectorized XOR + popcount passes, one pass per 64-bit word.
+    Matrix stored by columns (row per word of hash), so every pass runs over contiguous memory.
+    Used instead of MultiIndexHash for wide radii, when index has to probe too many neighbours of every part.
+
+    - width: length of hashes in bytes
+    """
+
+    def __init__(self, width: int):
+        self.width = width
+        self._columns = np.empty((-(-width // 8), 0), dtype=np.uint64)
+        self._payloads: list[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def to_words(self, packed: np.ndarray) -> np.ndarray:
+        """Turns (n, width) uint8 matrix into (n, width / 8) uint64 matrix, padded with zero bytes"""
+        packed = np.ascontiguousarray(packed, dtype=np.uint8).reshape(-1, self.width)
+        if padding := -self.width % 8:
+            packed = np.pad(packed, ((0, 0), (0, padding)))
+        return packed.view(np.uint64)
+
+    def extend(self, packed: np.ndarray, payloads: Sequence[Any]) -> None:
+        """Appends packed hashes (uint8 matrix, row per hash) with their payloads to matrix"""
+        if len(payloads):
+            self._columns = np.concatenate([self._columns, self.to_words(packed).T], axis=1)
+            self._payloads.extend(payloads)
+
+    def distances(self, query: bytes | np.ndarray) -> np.ndarray:
+        """Returns Hamming distances from packed query to every stored hash"""
+        query_words = self.to_words(np.frombuffer(query, dtype=np.uint8))[0]
+        distances = np.zeros(len(self._payloads), dtype=np.uint16)
+        buffer = np.empty(len(self._payloads), dtype=np.uint64)
+        for column, word in zip(self._columns, query_words):
+            np.bitwise_xor(column, word, out=buffer)
+            distances += popcount64(buffer).astype(np.uint16, copy=False)
+        return distances
+
+    def within(self, query: bytes | np.ndarray, radius: int) -> list[tuple[int, Any]]:
+        """Returns (distance, payload) of all stored hashes within radius, closest first"""
+        if not self._payloads:
+            return []
+        distances = self.distances(query)
+        positions = np.flatnonzero(distances <= radius)
+        positions = positions[np.argsort(distances[positions], kind='stable')]
+        return [(int(distances[x]), self._payloads[x]) for x in positions]
+
+
+class CascadeIndex:
+    """
+    Duplicate search in stages. Cheap 64-bit hashes of all stored pictures are compared with query first
+    (by MultiIndexHash or by HashMatrix scan), only the closest of them (shortlist) are confirmed
+    by more expensive hashes, one by one, until any of them fails.
+
+    - prefilter_radius: max distance between cheap hashes to get candidate into shortlist
+    - confirm_radii: max distance for each confirmation hash, in order they are checked
+    - shortlist_size: max count of candidates passed to confirmation
+    - chunks: count of parts of cheap hash in MultiIndexHash
+    - scan: if True, cheap hashes compared by HashMatrix instead of MultiIndexHash
+    """
+
+    def __init__(self, prefilter_radius: int, confirm_radii: Sequence[int], shortlist_size: int = 32,
+                 chunks: int = 4, scan: bool = False):
+        self.prefilter_radius = prefilter_radius
+        self.confirm_radii = tuple(confirm_radii)
+        self.shortlist_size = shortlist_size
+        self.scan = scan
+        self._prefilter: MultiIndexHash | HashMatrix = HashMatrix(8) if scan else MultiIndexHash(64, chunks)
+        self._confirm_hashes: list[list[int]] = [[] for _ in self.confirm_radii]
+        self._payloads: list[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def add_many(self, entries: Sequence[tuple[int, Sequence[int], Any]]) -> None:
+        """Stores (cheap hash, confirmation hashes, payload) entries in index"""
+        first_position = len(self._payloads)
+        for prefilter_hash, confirm_hashes, payload in entries:
+            for stored, value in zip(self._confirm_hashes, confirm_hashes):
+                stored.append(value)
+            self._payloads.append(payload)
+        positions = range(first_position, len(self._payloads))
+        if self.scan:
+            packed = np.array([x[0] for x in entries], dtype='>u8').view(np.uint8).reshape(-1, 8)
+            self._prefilter.extend(packed, positions)
+        else:
+            for (prefilter_hash, _, _), position in zip(entries, positions):
+                self._prefilter.add(prefilter_hash, position)
+
+    def shortlist(self, prefilter_hash: int) -> list[tuple[int, int]]:
+        """Returns distances and positions of closest stored cheap hashes within prefilter radius"""
+        if self.scan:
+            matches = self._prefilter.within(prefilter_hash.to_bytes(8, 'big'), self.prefilter_radius)
+        else:
+            matches = self._prefilter.search(prefilter_hash, self.prefilter_radius)
+        return matches[:self.shortlist_size]
+
+    def confirmed(self, position: int, confirm_hashes: Sequence[int]) -> bool:
+        """Checks candidate by confirmation hashes, stops at first failed one"""
+        return all((value ^ stored[position]).bit_count() <= radius
+                   for value, stored, radius in zip(confirm_hashes, self._confirm_hashes, self.confirm_radii))
+
+    def search(self, prefilter_hash: int, confirm_hashes: Sequence[int],
+               first_only: bool = False) -> list[tuple[int, Any]]:
+        """Returns (cheap hash distance, payload) of confirmed candidates, closest first.
+        If first_only, search stops at first confirmed candidate"""
+        found = []
+        for distance, position in self.shortlist(prefilter_hash):
+            if self.confirmed(position, confirm_hashes):
+                found.append((distance, self._payloads[position]))
+                if first_only:
+                    break
+        return found
+
+
+class SequenceIndex:
+    """
+    Index of hash sequences (fingerprints of clips, hash per sampled frame).
+    Sequences, which share at least one close frame with query, are aligned with it:
+    query frame counts as matched, if any stored frame not further than `max_offset` positions from it
+    is within `frame_radius`, so clips with shifted sample points still match.
+
+    - frame_radius: max distance between hashes of the same frame
+    - min_matched: min share of matched query frames to count clips as the same
+    - max_offset: max shift in positions between matched frames
+    """
+
+    def __init__(self, frame_radius: int, min_matched: float, max_offset: int = 1, chunks: int = 4):
+        self.frame_radius = frame_radius
+        self.min_matched = min_matched
+        self.max_offset = max_offset
+        self._frames = MultiIndexHash(64, chunks)
+        self._sequences: list[list[int]] = []
+        self._payloads: list[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def add(self, sequence: Sequence[int], payload: Any) -> None:
+        """Stores sequence with payload in index"""
+        position = len(self._payloads)
+        self._sequences.append(list(sequence))
+        self._payloads.append(payload)
+        for frame in sequence:
+            self._frames.add(frame, position)
+
+    def matched_share(self, query: Sequence[int], stored: Sequence[int]) -> float:
+        """Returns share of query frames, which have close frame in stored sequence within allowed offset"""
+        matched = 0
+        for i, frame in enumerate(query):
+            nearby = stored[max(0, i - self.max_offset):i + self.max_offset + 1]
+            if any((frame ^ x).bit_count() <= self.frame_radius for x in nearby):
+                matched += 1
+        return matched / max(len(query), len(stored))
+
+    def search(self, query: Sequence[int]) -> list[tuple[float, Any]]:
+        """Returns (matched share, payload) of stored sequences similar to query, most similar first"""
+        candidates = {position for frame in query for _, position in self._frames.search(frame, self.frame_radius)}
+        found = []
+        for position in candidates:
+            share = self.matched_share(query, self._sequences[position])
+            if share >= self.min_matched:
+                found.append((share, self._payloads[position]))
+        return sorted(found, key=lambda x: -x[0])
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+from os import environ as venv
+from typing import Iterable, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+"""Registry of HTTP clients shared by the whole bot. Clients are created once at startup and closed at shutdown,
+so connections to proxy, Sauce NAO and imageboards are kept alive between searches and every search
+doesn't pay for new TCP and TLS handshakes. Connections are pooled per host, HTTP/2 is used where server supports it,
+responses are compressed (httpx asks for gzip and deflate by itself)"""
+
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=120)
+SYNC_POOL_SIZE = 10  # connections per host in pool of requests session
+PREWARM_TIMEOUT = 10  # seconds
+PREWARM_URLS = (  # front pages of most used imageboards, connections to them opened at startup
+    'https://danbooru.donmai.us',
+    'https://gelbooru.com',
+    'https://yande.re',
+    'https://chan.sankaku.app',
+    'https://rule34.xxx',
+)
+
+
+class HttpClients:
+    """
+    Clients by purpose:
+
+    - boards: async client for imageboards, goes through proxy from PROXY variable
+    - nao: async client for Sauce NAO, without proxy
+    - session: requests session for sync search (local files and scripts)
+
+    Clients are created on first use if bot wasn't started properly, e.g. in scripts
+    """
+
+    def __init__(self):
+        self._boards: Optional[httpx.AsyncClient] = None
+        self._nao: Optional[httpx.AsyncClient] = None
+        self._session: Optional[requests.Session] = None
+        self._prewarm: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def async_client(proxy: Optional[str] = None) -> httpx.AsyncClient:
+        proxies = {'https://': proxy, 'http://': proxy} if proxy else None
+        return httpx.AsyncClient(proxies=proxies, follow_redirects=True, http2=True, limits=POOL_LIMITS)
+
+    @property
+    def boards(self) -> httpx.AsyncClient:
+        if self._boards is None or self._boards.is_closed:
+            self._boards = self.async_client(venv['PROXY'])
+        return self._boards
+
+    @property
+    def nao(self) -> httpx.AsyncClient:
+        if self._nao is None or self._nao.is_closed:
+            self._nao = self.async_client()
+        return self._nao
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=SYNC_POOL_SIZE, pool_maxsize=SYNC_POOL_SIZE)
+            self._session.mount('https://', adapter)
+            self._session.mount('http://', adapter)
+        return self._session
+
+    async def async_prewarm(self, urls: Iterable[str] = PREWARM_URLS) -> None:
+        """Opens connections to imageboards, so first search doesn't wait for handshakes. Failures are ignored"""
+        await asyncio.gather(*[self.boards.head(x, timeout=PREWARM_TIMEOUT) for x in urls], return_exceptions=True)
+
+    async def async_start(self, prewarm: bool = False) -> None:
+        """Creates clients, called at bot startup. Prewarm runs in background and doesn't delay startup"""
+        _ = self.boards, self.nao
+        if prewarm:
+            self._prewarm = asyncio.create_task(self.async_prewarm())
+
+    async def async_close(self) -> None:
+        """Closes all clients and their connections, called at bot shutdown"""
+        if self._prewarm is not None:
+            self._prewarm.cancel()
+        for client in (self._boards, self._nao):
+            if client is not None:
+                await client.aclose()
+        if self._session is not None:
+            self._session.close()
+        self._boards = self._nao = self._session = None
+
+
+http_clients = HttpClients()
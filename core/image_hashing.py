@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from io import BytesIO
+
+import imagehash as ihsh
+from PIL import Image
+
+"""Perceptual hashes of pictures, shared by duplicate checks and cache of reverse search results"""
+
+HASH_SIZE = 20  # side of average hash grid, same for stored and incoming pictures
+DECODE_SIZE = 32  # side of largest grid hashes are computed from (pHash: 8 * 4), pictures decoded not smaller
+
+
+def open_for_hashing(image: bytes | BytesIO | str | Image) -> Image:
+    """Opens picture for hashing. JPEG is decoded in grayscale at smallest scale (1/2, 1/4 or 1/8 by draft mode),
+    which is still larger than grid of any hash, instead of full decode"""
+    if isinstance(image, bytes):  # Image.open takes bytes for path
+        image = BytesIO(image)
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    image.draft('L', (DECODE_SIZE, DECODE_SIZE))  # does nothing for other formats or already loaded picture
+    return image.convert('L')
+
+
+def picture_hashes(image: bytes | BytesIO | str | Image) -> dict[str, str]:
+    """Returns all hashes of picture as hex strings, in form they stored next to post"""
+    image = open_for_hashing(image)
+    return {
+        'dhash': str(ihsh.dhash(image)),
+        'phash': str(ihsh.phash(image)),
+        'hash': str(ihsh.average_hash(image, hash_size=HASH_SIZE)),
+    }
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from os import environ as venv
+from typing import Any, Hashable, Iterable, Optional
+
+from core.exceptions import NAOQuotaExhausted
+
+"""Scheduler of requests to Sauce NAO. Sauce NAO limits count of searches in short (30 seconds)
+and long (24 hours) windows and reports remaining count with every result, so every search waits here
+until both limits allow it. Waiting searches of different users are served in turns,
+so one user with many pictures doesn't hold back the rest. Limits are counted for every API key separately,
+searches are spread over all keys."""
+
+SHORT_WINDOW = 30  # seconds
+LONG_WINDOW = 24 * 60 * 60
+SHORT_LIMIT = 4  # limits of free account, updated from responses of Sauce NAO for every key
+LONG_LIMIT = 100
+MAX_QUEUE_WAIT = 15 * 60  # seconds, if search has to wait longer, quota is counted as exhausted
+
+
+class TokenBucket:
+    """
+    Count of requests allowed in window. Tokens are spent by requests and restored evenly over the window
+
+    - capacity: count of requests allowed in window
+    - window: length of window in seconds
+    """
+
+    def __init__(self, capacity: int, window: float):
+        self.capacity = capacity
+        self.window = window
+        self.tokens: float = capacity
+        self._updated = time.monotonic()
+
+    def refill(self) -> None:
+        """Restores tokens for time passed since last refill"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.capacity / self.window)
+        self._updated = now
+
+    def wait_time(self, count: int = 1) -> float:
+        """Returns seconds till count of tokens is available"""
+        self.refill()
+        deficit = count - self.tokens
+        return max(0.0, deficit * self.window / self.capacity)
+
+    def take(self) -> None:
+        """Spends token for request"""
+        self.refill()
+        self.tokens -= 1
+
+    def update(self, limit: int, remaining: int) -> None:
+        """Syncs bucket with limit and remaining count, reported by Sauce NAO. Count of Sauce NAO is trusted
+        both ways: bucket is emptied if quota is spent faster, and refilled if quota was restored sooner"""
+        self.refill()
+        self.capacity = max(1, limit)
+        self.tokens = min(self.capacity, remaining)
+
+
+class NaoKey:
+    """
+    API key of Sauce NAO with its own limits. Key, which reports its quota as spent or is rejected,
+    is benched: scheduler doesn't use it till bench time is over
+
+    - api_key: key itself, None for searches without key
+    """
+
+    def __init__(self, api_key: Optional[str], short_limit: int = SHORT_LIMIT, long_limit: int = LONG_LIMIT):
+        self.api_key = api_key
+        self.short = TokenBucket(short_limit, SHORT_WINDOW)
+        self.long = TokenBucket(long_limit, LONG_WINDOW)
+        self.searches: int = 0
+        self.rejections: int = 0
+        self._benched_until: float = 0
+
+    @property
+    def buckets(self) -> tuple[TokenBucket, TokenBucket]:
+        return self.short, self.long
+
+    @property
+    def name(self) -> str:
+        """Key in form safe for logs and metrics"""
+        return f'...{self.api_key[-4:]}' if self.api_key else 'anonymous'
+
+    @property
+    def bench_time(self) -> float:
+        """Returns seconds left till key can be used again"""
+        return max(0.0, self._benched_until - time.monotonic())
+
+    def bench(self, seconds: float) -> None:
+        self._benched_until = max(self._benched_until, time.monotonic() + seconds)
+
+    def wait_time(self, count: int = 1) -> float:
+        """Returns seconds till key allows count of searches"""
+        return max(self.bench_time, *(x.wait_time(count) for x in self.buckets))
+
+    def take(self) -> None:
+        """Spends tokens of both buckets for search"""
+        self.searches += 1
+        for bucket in self.buckets:
+            bucket.take()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            'short_remaining': int(self.short.tokens),
+            'long_remaining': int(self.long.tokens),
+            'searches': self.searches,
+            'rejections': self.rejections,
+            'benched_for': int(self.bench_time),
+        }
+
+
+def api_keys_from_env() -> list[Optional[str]]:
+    """Returns API keys of Sauce NAO from SAUCENAO_KEYS (separated by commas) or SAUCENAO_KEY variable"""
+    keys = venv.get('SAUCENAO_KEYS') or venv.get('SAUCENAO_KEY') or ''
+    return [x.strip() for x in keys.split(',') if x.strip()] or [None]
+
+
+class NaoScheduler:
+    """
+    Queue of searches waiting for Sauce NAO quota. Searches of every user wait in their own queue,
+    queues are served in round robin order, one search per turn.
+    Every search is sent with key, which has the most of remaining daily quota, so searches
+    are spread over all keys and throughput grows with count of keys.
+
+    - api_keys: API keys of Sauce NAO
+    """
+
+    def __init__(self, api_keys: Iterable[Optional[str]] = (None,)):
+        self.keys: list[NaoKey] = [NaoKey(x) for x in api_keys]
+        self._queues: dict[Hashable, deque[asyncio.Future]] = {}
+        self._turns: deque[Hashable] = deque()  # users with waiting searches, in order of their turns
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def searches_ahead(self, user_id: Hashable) -> int:
+        """Returns count of waiting searches, which will be sent before new search of user"""
+        own = len(self._queues.get(user_id, ()))
+        return own + sum(min(len(x), own + 1) for key, x in self._queues.items() if key != user_id)
+
+    def expected_wait(self, user_id: Hashable = None) -> float:
+        """Returns seconds, new search of user will wait for its turn. Searches are spread over keys,
+        so every key has to allow its share of searches ahead"""
+        share = -(-(self.searches_ahead(user_id) + 1) // len(self.keys))
+        return min(x.wait_time(share) for x in self.keys)
+
+    def best_key(self) -> Optional[NaoKey]:
+        """Returns key, which allows search right now and has the most of remaining daily quota"""
+        ready = [x for x in self.keys if x.wait_time() == 0]
+        return max(ready, key=lambda x: x.long.tokens) if ready else None
+
+    def take_blocking(self) -> NaoKey:
+        """Same as acquire for sync search: waits in calling thread, till any key allows search,
+        and returns key with the most of remaining daily quota. Sync searches don't take turns with queued ones.
+        Rises NAOQuotaExhausted, if quota won't allow search in reasonable time"""
+        key = self.best_key() or min(self.keys, key=lambda x: x.wait_time())
+        if (wait := key.wait_time()) > MAX_QUEUE_WAIT:
+            raise NAOQuotaExhausted
+        time.sleep(wait)
+        key.take()
+        return key
+
+    async def acquire(self, user_id: Hashable = None) -> NaoKey:
+        """Waits until search of user can be sent and returns key to send it with. \n
+        Rises NAOQuotaExhausted, if quota won't allow search in reasonable time"""
+        if self.expected_wait(user_id) > MAX_QUEUE_WAIT:
+            raise NAOQuotaExhausted
+        turn = asyncio.get_running_loop().create_future()
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._turns.append(user_id)
+        self._queues[user_id].append(turn)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self.dispatch())
+        return await turn
+
+    def fail_waiting(self, error: Exception) -> None:
+        """Rises error in all waiting searches and empties queues"""
+        for queue in self._queues.values():
+            for turn in queue:
+                if not turn.done():
+                    turn.set_exception(error)
+        self._queues.clear()
+        self._turns.clear()
+
+    async def dispatch(self) -> None:
+        """Lets waiting searches go one by one, as soon as any key has tokens in both buckets.
+        If quota of all keys was spent (or keys were benched) while searches waited,
+        waiting searches fail instead of sleeping till quota is restored"""
+        while self._turns:
+            key = self.best_key()
+            if key is None:
+                wait = min(x.wait_time() for x in self.keys)
+                if wait > MAX_QUEUE_WAIT:
+                    self.fail_waiting(NAOQuotaExhausted())
+                    break
+                await asyncio.sleep(wait)
+                continue
+            user_id = self._turns.popleft()
+            turn = self._queues[user_id].popleft()
+            if self._queues[user_id]:
+                self._turns.append(user_id)
+            else:
+                del self._queues[user_id]
+            if turn.done():  # search was cancelled while waiting
+                continue
+            key.take()
+            turn.set_result(key)
+
+    @staticmethod
+    def update(key: NaoKey, header: dict[str, Any]) -> None:
+        """Syncs buckets of key with limits from header of Sauce NAO json"""
+        if 'short_limit' in header and 'short_remaining' in header:
+            key.short.update(int(header['short_limit']), int(header['short_remaining']))
+        if 'long_limit' in header and 'long_remaining' in header:
+            key.long.update(int(header['long_limit']), int(header['long_remaining']))
+            if int(header['long_remaining']) <= 0:
+                key.bench(LONG_WINDOW)
+
+    @staticmethod
+    def limit_reached(key: NaoKey, long: bool = False) -> None:
+        """Empties bucket of key, which limit Sauce NAO reported as reached. Key with spent daily quota is benched"""
+        key.rejections += 1
+        bucket = key.long if long else key.short
+        bucket.update(bucket.capacity, 0)
+        if long:
+            key.bench(LONG_WINDOW)
+
+    @staticmethod
+    def rejected(key: NaoKey) -> None:
+        """Benches key, which Sauce NAO doesn't accept"""
+        key.rejections += 1
+        key.bench(LONG_WINDOW)
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        """Returns state of every key: remaining quota, count of searches and rejections, time left on bench"""
+        return {x.name: x.metrics() for x in self.keys}
+
+    def metrics_report(self) -> str:
+        """Returns metrics of keys as text, one line per key"""
+        return '\n'.join(f'{name}: ' + ', '.join(f'{field} {value}' for field, value in metrics.items())
+                         for name, metrics in self.metrics().items())
+
+
+nao_scheduler = NaoScheduler(api_keys_from_env())
@@ -5,6 +5,9 @@ from PIL import Image
 
 from Bot.P_Files import FileType as ftype
 
+SEARCH_UPLOAD_SIZE = 800  # max side of picture uploaded for reverse search, Sauce NAO compares small thumbnails
+SEARCH_UPLOAD_QUALITY = 85
+
 
 class PhotoResise:
     """
@@ -50,3 +53,21 @@ class PhotoResise:
         """
         resized_img = self.resize()
         return self.save(resized_img)
+
+
+def downscale_for_search(file: bytes, bound: int = SEARCH_UPLOAD_SIZE, quality: int = SEARCH_UPLOAD_QUALITY) -> bytes:
+    """
+    Shrinks picture to fit into bound and re-encodes it as compact JPEG before upload to reverse search.
+    JPEG is decoded at reduced scale by draft mode, so it is fast enough for executor.
+    :return: re-encoded picture, or original one if it is smaller or can't be opened
+    """
+    try:
+        img = Image.open(BytesIO(file))
+        img.draft('RGB', (bound, bound))
+        img = img.convert('RGB')
+        img.thumbnail((bound, bound))
+        output = BytesIO()
+        img.save(output, 'JPEG', quality=quality, optimize=True)
+    except OSError:
+        return file
+    return min(output.getvalue(), file, key=len)
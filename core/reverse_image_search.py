@@ -3,60 +3,76 @@ from __future__ import annotations
 import copy
 from typing import Iterable, Optional
 
-import requests
+from bs4 import BeautifulSoup
 
 from core import exceptions
-from parsers.sause_nao_operations import SauseNaoParser, NAOArtistParser, links_to_imageboards
+from core.http_clients import http_clients
+from parsers.sause_nao_operations import SauseNaoParser, NAOJsonParser, NaoResult, NAO_HIGH_SIMILARITY, \
+    links_to_imageboards
 from parsers.validator import ValidatorBuilder
 from parsers.yandex_parser import YandexParser
 
 
 # whole cycle of requesting sources for picture
 
-def get_artists(table: list, main_parser: SauseNaoParser, similarity_degree: str) -> Iterable[Optional[str]]:
-    """Gets artist's nicknames from Sauce NAO page through NAOArtistParser"""
-    artist_parser = NAOArtistParser(main_parser, [])
+def get_artists(table: list[NaoResult], similarity_degree: str) -> Iterable[Optional[str]]:
+    """Gets artist's nicknames from decoded results of Sauce NAO search"""
     if similarity_degree == 'high':
-        return artist_parser.get_artists(
-            [x for x in table if float(main_parser.get_similarity_procent(x)) >= 87])
+        return [name for x in table if x.similarity >= NAO_HIGH_SIMILARITY for name in x.creators]
     elif similarity_degree == 'low':
-        return artist_parser.get_artists(
-            [x for x in table if float(main_parser.get_similarity_procent(x)) <= 87])
+        return [name for x in table if x.similarity <= NAO_HIGH_SIMILARITY for name in x.creators]
 
 
-def search_for_sources(file, subparser: YandexParser) -> tuple[dict, Iterable[Optional[str]]]:
+def collect_sources(main_parser: SauseNaoParser, subparser: YandexParser,
+                    soup: BeautifulSoup | dict) -> tuple[dict, Iterable[Optional[str]]]:
+    """Gets links to imageboards and artists from Sauce NAO page, same for sync and async search"""
+    subparser.parser = main_parser  # yandex parser use part of functional of sauce nao parser
+    # and shares the same output dictionary
+    watcher = ValidatorBuilder()
+    watcher.soup = soup
+    subparser.url = main_parser.get_redirection_link(watcher.soup)
+    # sauce nao allows to search requested picture with another engines
+    # if script fails connects to nao and get soup from it
+    # search will fail completely
+    # becouse redirect link stored in souce nao responce
+    watcher.table = main_parser.decode_table(watcher.soup)
+    watcher.links_to_high_similar_pic = main_parser.get_high_similar_results(watcher.table)
+    if watcher.links_to_high_similar_pic:
+        main_parser.parse_links_to_imageboards(watcher.links_to_high_similar_pic, main_parser.parsed_links)
+        artists = get_artists(watcher.table, 'high')
+    else:
+        watcher.links_to_less_similar_pic = main_parser.get_less_similar_results(watcher.table)
+        main_parser.parse_links_to_imageboards(watcher.links_to_less_similar_pic, main_parser.parsed_links)
+        artists = get_artists(watcher.table, 'low')
+
+    if not any([x for x in main_parser.parsed_links.values() if x != []]):
+        raise exceptions.NoSimilarPics
+
+    return main_parser.parsed_links, artists
+
+
+def search_for_sources(file: bytes, subparser: YandexParser) -> tuple[dict, Iterable[Optional[str]]]:
     # yandex parser creates
     # instance of selenium browser
     # generate new browser every time will slow down reqests miserbly
     # instead code take subparser as argument and re-use browser instance
-    with requests.Session() as session:
-        main_parser = SauseNaoParser(file, session, copy.copy(links_to_imageboards))
-        subparser.parser = main_parser  # yandex parser use part of functional of sauce nao parser
-        # and shares the same output dictionary
-        watcher = ValidatorBuilder()
-        watcher.soup = main_parser.get_soup()
-        subparser.url = main_parser.get_redirection_link(watcher.soup)
-        # sauce nao allows to search requested picture with another engines
-        # if script fails connects to nao and get soup from it
-        # search will fail completely
-        # becouse redirect link stored in souce nao responce
-        watcher.table = main_parser.get_table(watcher.soup)
-        watcher.links_to_high_similar_pic = main_parser.get_high_similar_results(watcher.table)
-        if watcher.links_to_high_similar_pic:
-            main_parser.parse_links_to_imageboards(watcher.links_to_high_similar_pic, main_parser.parsed_links)
-            artists = get_artists(watcher.table, main_parser, 'high')
-        else:
-            watcher.links_to_less_similar_pic = main_parser.get_less_similar_results(watcher.table)
-            main_parser.parse_links_to_imageboards(watcher.links_to_less_similar_pic, main_parser.parsed_links)
-            artists = get_artists(watcher.table, main_parser, 'low')
-
-        if not any([x for x in main_parser.parsed_links.values() if x != []]):
-            raise exceptions.NoSimilarPics
-
-        return main_parser.parsed_links, artists
+    # the same for connection to sauce nao, session is shared.
+    # Search goes to json API with keys and limits of core.nao_scheduler, same as async one
+    main_parser = NAOJsonParser(file, http_clients.session, copy.copy(links_to_imageboards))
+    return collect_sources(main_parser, subparser, main_parser.get_soup())
+
+
+async def async_search_for_sources(file: bytes, subparser: YandexParser,
+                                   user_id=None) -> tuple[dict, Iterable[Optional[str]]]:
+    """Same as search_for_sources for bot handlers: while Sauce NAO answers,
+    event loop serves other users, so their searches overlap. Uses json API of Sauce NAO instead of html page,
+    searches of different users take turns in core.nao_scheduler"""
+    main_parser = NAOJsonParser(file, http_clients.nao, copy.copy(links_to_imageboards), user_id)
+    soup = await main_parser.async_get_soup()
+    return collect_sources(main_parser, subparser, soup)
 
 
 def search_with_local_file(filepath: str, subparser: YandexParser) -> tuple[dict, Iterable[Optional[str]]]:
     with open(filepath, 'rb') as file:
-        return search_for_sources(file, subparser)
+        return search_for_sources(file.read(), subparser)  # bytes can be sent again, if search is retried
 
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+import motor.motor_asyncio as async_motor
+
+from core.image_hashing import picture_hashes
+
+"""Cache of reverse search results. The same pictures are sent by different users again and again,
+so links from Sauce NAO, artists and tags from imageboards are stored by perceptual hashes of picture:
+next search of this picture takes them from cache and doesn't spend requests to Sauce NAO and imageboards.
+Cache is stored in database, so it survives restarts of bot."""
+
+client = async_motor.AsyncIOMotorClient('localhost', 27017)
+db = client['BrokenNest']
+
+CACHE_TTL = timedelta(days=30)  # results older than that are searched again, tags on imageboards change
+CACHE_SIZE = 20000  # max count of cached pictures, least recently used are evicted
+HASH_FIELDS = ('dhash', 'phash', 'hash')  # hashes, which identify picture in cache
+# resized or recompressed copies differ from original by few bits of dHash. dHash is split into parts,
+# and copy within DHASH_RADIUS has at least one part equal to original (pigeonhole principle),
+# so results are looked up by parts and then checked by whole dHash
+DHASH_PARTS = 8
+DHASH_RADIUS = DHASH_PARTS - 1
+# dHash alone is close for many flat or line art pictures, so result found by it is confirmed by other hashes,
+# with the same thresholds as in duplicate checks (image_check)
+PHASH_RADIUS = 10
+AHASH_RADIUS = 20
+
+
+def distance(first: str, second: str) -> int:
+    """Returns count of different bits between hashes in hex form"""
+    return (int(first, 16) ^ int(second, 16)).bit_count()
+
+
+def dhash_parts(dhash: str) -> list[str]:
+    """Splits hex dHash into parts, prefixed by position, so equal parts at different positions don't match"""
+    width = len(dhash) // DHASH_PARTS
+    return [f'{i}:{dhash[i * width:(i + 1) * width]}' for i in range(DHASH_PARTS)]
+
+
+def is_same_picture(hashes: dict[str, str], cached: dict[str, Any]) -> bool:
+    """Checks if cached result belongs to picture with given hashes"""
+    return (distance(hashes['dhash'], cached['dhash']) <= DHASH_RADIUS
+            and distance(hashes['phash'], cached['phash']) <= PHASH_RADIUS
+            and distance(hashes['hash'], cached['hash']) <= AHASH_RADIUS)
+
+
+class SearchCache:
+    """
+    Reverse search results in mongo collection, one document per picture. Document is identified by all hashes
+    of picture and found by parts of its dHash, then confirmed by whole dHash, pHash and average hash.
+    Expired documents are removed by TTL index, when size limit is exceeded, least recently used ones are removed
+
+    - collection: mongo collection of cached results
+    - ttl: how long result stays in cache
+    - size: max count of cached pictures
+    """
+
+    def __init__(self, collection: async_motor.AsyncIOMotorCollection, ttl: timedelta = CACHE_TTL,
+                 size: int = CACHE_SIZE):
+        self.collection = collection
+        self.ttl = ttl
+        self.size = size
+        self._prepared: bool = False
+
+    async def async_prepare(self) -> None:
+        """Creates indexes of collection once"""
+        if self._prepared:
+            return
+        await self.collection.create_index('key', unique=True)
+        await self.collection.create_index('dhash_parts')
+        await self.collection.create_index('created', expireAfterSeconds=int(self.ttl.total_seconds()))
+        await self.collection.create_index('last_used')
+        self._prepared = True
+
+    @staticmethod
+    async def async_key(image: bytes | str) -> dict[str, str]:
+        """Computes hashes of picture, which identify it in cache, in executor"""
+        return await asyncio.get_running_loop().run_in_executor(None, picture_hashes, image)
+
+    @staticmethod
+    def cached_hashes(cached: dict[str, Any]) -> dict[str, str]:
+        """Returns hashes, which cached result is stored by. Fields found for copy of picture
+        are added to result of original with them, not to new document"""
+        return {x: cached[x] for x in HASH_FIELDS}
+
+    async def async_get(self, hashes: dict[str, str]) -> Optional[dict[str, Any]]:
+        """Returns closest cached result for picture and marks it as recently used, or None if there is no fresh one.
+        TTL index removes expired results only once a minute, so age is checked here as well"""
+        await self.async_prepare()
+        now = datetime.utcnow()
+        query = {'dhash_parts': {'$in': dhash_parts(hashes['dhash'])}, 'created': {'$gt': now - self.ttl}}
+        found = [x async for x in self.collection.find(query) if is_same_picture(hashes, x)]
+        if not found:
+            return None
+        cached = min(found, key=lambda x: distance(hashes['dhash'], x['dhash']))
+        await self.collection.update_one({'_id': cached['_id']}, {'$set': {'last_used': now}})
+        return cached
+
+    async def async_put(self, hashes: dict[str, str], **fields: Any) -> None:
+        """Adds fields (links, artists, tags) to cached result for picture"""
+        await self.async_prepare()
+        now = datetime.utcnow()
+        key = ':'.join(hashes[x] for x in HASH_FIELDS)
+        await self.collection.update_one({'key': key},
+                                         {'$set': {**fields, **hashes, 'dhash_parts': dhash_parts(hashes['dhash']),
+                                                   'last_used': now},
+                                          '$setOnInsert': {'created': now}},
+                                         upsert=True)
+        await self.async_evict()
+
+    async def async_evict(self) -> None:
+        """Removes least recently used results, which don't fit into size limit"""
+        overflow = await self.collection.estimated_document_count() - self.size
+        if overflow > 0:
+            oldest = self.collection.find({}, {'_id': True}).sort('last_used', 1).limit(overflow)
+            await self.collection.delete_many({'_id': {'$in': [x['_id'] async for x in oldest]}})
+
+
+search_cache = SearchCache(db.search_cache)
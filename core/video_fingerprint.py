@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Iterator
+
+import av
+import imagehash as ihsh
+from PIL import Image
+
+"""Fingerprints of animations and videos: dHashes of several frames, sampled evenly along the clip.
+Frames are taken by seeking to nearest keyframe before each sample point and decoding from it,
+so whole clip is never decoded. Fingerprint stored next to post as hex string, 16 symbols per frame."""
+
+FRAME_SAMPLES = 8  # count of frames sampled from clip
+FRAME_SIZE = 64  # side of box, frames are scaled into before hashing
+
+
+def sampled_frames(clip: BytesIO | str, samples: int = FRAME_SAMPLES) -> Iterator[Image.Image]:
+    """Yields frames of clip, taken at evenly spaced points of its duration"""
+    with av.open(clip) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        if stream.duration:
+            duration = stream.duration * stream.time_base
+        else:  # some containers know only overall duration
+            duration = (container.duration or 0) / av.time_base
+        for sample in range(samples):
+            point = duration * (sample + 0.5) / samples
+            container.seek(int(point / stream.time_base), stream=stream)  # jumps to keyframe before point
+            for frame in container.decode(stream):
+                if frame.time is None or frame.time >= point:
+                    image = frame.to_image()
+                    image.thumbnail((FRAME_SIZE, FRAME_SIZE))
+                    yield image
+                    break
+
+
+def clip_fingerprint(clip: BytesIO | str, samples: int = FRAME_SAMPLES) -> list[int]:
+    """Returns dHashes of sampled frames of clip, or empty list if clip can't be decoded"""
+    if isinstance(clip, BytesIO):
+        clip.seek(0)
+    try:
+        return [int(str(ihsh.dhash(x)), 16) for x in sampled_frames(clip, samples)]
+    except (av.FFmpegError, IndexError):  # broken file or file without video stream
+        return []
+
+
+def fingerprint_to_hex(frames: list[int]) -> str:
+    """Packs frame hashes into string, stored next to post"""
+    return ''.join(f'{x:016x}' for x in frames)
+
+
+def hex_to_fingerprint(packed: str) -> list[int]:
+    """Unpacks frame hashes from string, stored next to post"""
+    return [int(packed[i:i + 16], 16) for i in range(0, len(packed), 16)]
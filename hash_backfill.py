@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from image_check import BACKFILL_CHUNK, backfill_hashes
+
+"""Command-line tool to hash whole archive of posted pictures (chat exports and posts collection) in parallel.
+Results are written down chunk by chunk, so tool can be interrupted and started again:
+already hashed messages and posts are skipped, rerun processes only new ones.
+
+    python hash_backfill.py --workers 16
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Hashes archived posts for already-posted checks')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='count of processes hashing pictures (default: count of cpu cores)')
+    parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK,
+                        help='count of pictures hashed between writes of results')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # pictures are sent to workers in batches, so process pool doesn't spend more time on messaging than on hashing
+        mapper = partial(pool.map, chunksize=max(1, args.chunk_size // (args.workers * 4)))
+        hashed = backfill_hashes(mapper, args.chunk_size)
+    for source, count in zip(('broken nest export', 'anal carnaval export', 'posts collection'), hashed):
+        print(f'{source}: {count} pictures hashed')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,86 @@
 from __future__ import annotations
 
+import asyncio
+import glob
+import hashlib
 import json
-from typing import Optional, Mapping, Any
+import os
+from io import BytesIO
+from typing import Any, Callable, Mapping, NamedTuple, Optional
 
-import imagehash as ihsh
+import motor.motor_asyncio as async_motor
 import numpy as np
+from bson import ObjectId
 from PIL import Image
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.database import Database
 
+from core.hash_index import CascadeIndex, SequenceIndex
+from core.image_hashing import HASH_SIZE, picture_hashes
+from core.video_fingerprint import clip_fingerprint, hex_to_fingerprint
+
 client = MongoClient('localhost', 27017)
 db = client['BrokenNest']
+async_client = async_motor.AsyncIOMotorClient('localhost', 27017)  # same database for checks from bot's event loop
+async_db = async_client['BrokenNest']
+
+HASH_BYTES = HASH_SIZE ** 2 // 8
+HASH_FIELDS = ('dhash', 'phash', 'hash')  # names of hashes in stored posts, in order of cascade
+EXACT_FIELDS = ('file_unique_id', 'sha256')  # names of exact keys of file in stored posts
+ARCHIVE_FILE = 'hashes.npy'  # name of file with packed ids and hashes, stored next to chat export
+ARCHIVE_PART = 'hashes.part{}.npy'  # chunks written by unfinished backfill, merged into archive when it's done
+FAILED_FILE = 'hashes_failed.npy'  # ids of messages, which pictures can't be hashed, so backfill skips them
+archive_dtype = np.dtype([('id', '<i8'), ('dhash', '<u8'), ('phash', '<u8'), ('hash', 'u1', (HASH_BYTES,)),
+                          ('sha256', 'u1', (32,))])
+
+# thresholds of duplicates search cascade, max count of different bits between hashes of the same picture
+DHASH_RADIUS = 10  # 64-bit dHash, compared with every stored post
+PHASH_RADIUS = 10  # 64-bit pHash, compared only with shortlisted posts
+AHASH_RADIUS = 20  # 400-bit average hash, compared with posts, which passed pHash check
+SHORTLIST_SIZE = 32  # max count of posts, passed from dHash stage to confirmation
+INDEX_CHUNKS = 4  # count of dHash parts, used as keys in near-duplicate index
+# if radius needs more flipped bits per part, index probes too much and vectorized scan is faster. Default dHash radius
+# needs 2 bits per part: 137 probes of every part, and scan over 200000 posts takes third of time of index search
+MAX_PART_RADIUS = 1
+FRAME_RADIUS = 10  # max distance between dHashes of the same frame of animation or video
+MIN_MATCHED_FRAMES = 0.6  # min share of matched sampled frames to count clips as the same
+FRAME_OFFSET = 1  # max shift in positions between matched frames of clips
+BACKFILL_CHUNK = 2000  # count of pictures hashed by backfill between writes of results
+
+
+def file_digest(content: bytes) -> str:
+    """Returns SHA-256 of file content as hex string, exact key of file next to telegram file_unique_id"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path: str) -> Optional[dict[str, str]]:
+    """Returns hashes and SHA-256 of locally stored picture or None, if it can't be opened.
+    Used by backfill workers"""
+    try:
+        with open(path, 'rb') as file:
+            content = file.read()
+        return picture_hashes(BytesIO(content)) | {'sha256': file_digest(content)}
+    except OSError:
+        return None
+
+
+def hashes_to_ints(hashes: dict[str, str]) -> tuple[int, ...]:
+    """Turns hex hashes into ints, ordered as stages of cascade"""
+    return tuple(int(hashes[x], 16) for x in HASH_FIELDS)
+
+
+class IndexedPost(NamedTuple):
+    """Everything about stored post, what indexes need
+
+    - hashes: perceptual hashes as ints, ordered as stages of cascade
+    - id: id of post, returned by checks
+    - frames: hashes of sampled frames of animation or video
+    - keys: exact keys of posted file (telegram file_unique_id, SHA-256 of content), which are known
+    """
+    hashes: tuple[int, ...]
+    id: Any
+    frames: Optional[list[int]] = None
+    keys: tuple[str, ...] = ()
 
 
 class ImageOpener:
@@ -27,33 +97,107 @@ class ImageOpener:
         """Inserts "_thumb' str into path to lacal file"""
         return image.split('.')[0] + '_thumb.' + image.split('.')[1]
 
-    def open(self, image: str) -> Image:
-        """Opens local saved sample as PIL Image object"""
+    def path(self, image: str) -> str:
+        """Returns full path to local saved sample"""
         path = f"{self.base_dir}/{image}"
         if self.split_image_name:
             image_ = self.split_name(image)
             path = f"{self.base_dir}/{image_}"
         elif self.base_dir is None:
             path = image
-        return Image.open(path)
+        return path
+
+    def open(self, image: str) -> Image:
+        """Opens local saved sample as PIL Image object"""
+        return Image.open(self.path(image))
 
 
 class IsPictureAlreadyPosted:
     """class to manage samples of stored pictures and compare their hash with new samples"""
-    def __init__(self, dir_path: str | Database[Mapping[str, Any] | Any], opener: ImageOpener):
+    def __init__(self, dir_path: str | Database[Mapping[str, Any] | Any], opener: ImageOpener,
+                 radii: tuple[int, int, int] = (DHASH_RADIUS, PHASH_RADIUS, AHASH_RADIUS),
+                 scan: Optional[bool] = None):
         self._dir_path = dir_path
         self.opener = opener
+        self.radii = radii
+        self.scan: bool = radii[0] // INDEX_CHUNKS > MAX_PART_RADIUS if scan is None else scan
+        self._index: Optional[CascadeIndex] = None
+        self._clips: Optional[SequenceIndex] = None
+        self._exact: dict[str, Any] = {}
+        self._last_post_id: Optional[ObjectId] = None
+        self._index_lock: Optional[asyncio.Lock] = None
+        self._archive: Optional[np.ndarray] = None
+
+    @property
+    def archive_path(self) -> str:
+        return f'{self._dir_path}/{ARCHIVE_FILE}'
+
+    @property
+    def failed_path(self) -> str:
+        return f'{self._dir_path}/{FAILED_FILE}'
+
+    def part_paths(self) -> list[str]:
+        """Returns paths to chunks of unfinished backfill, in order they were written"""
+        paths = glob.glob(f'{glob.escape(self._dir_path)}/{ARCHIVE_PART.format("*")}')
+        return sorted(paths, key=lambda x: int(x.rsplit('part', 1)[1].split('.')[0]))
 
     @staticmethod
-    def id_return(photo_name: str | dict, datafile: dict) -> str | bool:
-        """returns id of the post in channel, corresponding to sample, stored locally"""
-        if datafile is not db:
-            for saved_message in datafile['messages']:
-                if 'photo' in saved_message and saved_message['photo'] == photo_name:
-                    return saved_message['id']
-        elif datafile is db:
-            return photo_name['id']
-        return False
+    def save_atomic(path: str, array: np.ndarray) -> None:
+        """Writes array to temporary file and replaces target with it, so interrupted write
+        never leaves truncated file"""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, array)
+        os.replace(temp_path, path)
+
+    def is_archive_outdated(self) -> bool:
+        """Checks if chat export was never packed or was replaced with newer one after packing"""
+        if not os.path.exists(self.archive_path):
+            return True
+        if np.load(self.archive_path, mmap_mode='r').dtype != archive_dtype:  # packed by older version
+            return True
+        export_path = f'{self._dir_path}/result.json'
+        return os.path.exists(export_path) and os.path.getmtime(export_path) > os.path.getmtime(self.archive_path)
+
+    @staticmethod
+    def archive_record(message_id: int, hashes: dict[str, str]) -> tuple:
+        """Packs id and hashes of message into record of archive"""
+        return (message_id, int(hashes['dhash'], 16), int(hashes['phash'], 16),
+                np.frombuffer(bytes.fromhex(hashes['hash']), np.uint8),
+                np.frombuffer(bytes.fromhex(hashes['sha256']), np.uint8))
+
+    def load_packed(self) -> np.ndarray:
+        """Returns records of archive and chunks of unfinished backfill, if they were packed by current version,
+        otherwise empty array. Records are unique by id: merge may be interrupted before chunks are removed"""
+        loaded = [np.load(x) for x in [self.archive_path, *self.part_paths()] if os.path.exists(x)]
+        loaded = [x for x in loaded if x.dtype == archive_dtype]
+        if not loaded:
+            return np.empty(0, dtype=archive_dtype)
+        packed = np.concatenate(loaded)
+        return packed[np.sort(np.unique(packed['id'], return_index=True)[1])]
+
+    def load_failed(self) -> np.ndarray:
+        """Returns ids of messages, which pictures can't be hashed"""
+        return np.load(self.failed_path) if os.path.exists(self.failed_path) else np.empty(0, dtype='<i8')
+
+    def merge_archive(self) -> None:
+        """Writes archive and chunks of backfill as single archive and removes chunks"""
+        self.save_atomic(self.archive_path, self.load_packed())
+        for path in self.part_paths():
+            os.remove(path)
+
+    @property
+    def archive(self) -> np.ndarray:
+        """Packed ids and hashes of chat export, memory-mapped from disk. Export is packed by hash_backfill tool,
+        bot never reads result.json: if archive is missing or outdated, only already packed messages are checked"""
+        if self._archive is None:
+            if self.is_archive_outdated():
+                print(f'archive of {self._dir_path} is missing or older than export, run hash_backfill.py')
+            if os.path.exists(self.archive_path) and not self.part_paths():
+                self._archive = np.load(self.archive_path, mmap_mode='r')
+            if self._archive is None or self._archive.dtype != archive_dtype:
+                self._archive = self.load_packed()  # chunks of unfinished backfill are checked as well
+        return self._archive
 
     @staticmethod
     def set_photo_url(photo: dict, data: dict):
@@ -64,52 +208,236 @@ class IsPictureAlreadyPosted:
             photo_url = photo
         return photo_url
 
-    def hash_compare(self, image: bytes | Image, similars: list, data: json) -> bool | str:
-        """If hash stored sample and new pic are identical, returns id of stored sample, otherwise returns False"""
-        if similars:
-            model = ihsh.average_hash(image, hash_size=20)
-            image_cache = {}
-            for photo in similars:
-                photo_url = self.set_photo_url(photo, data)
-                if photo_url not in image_cache:
-                    photo_data = self.opener.open(photo_url)
-                    image_cache[photo_url] = ihsh.average_hash(photo_data, hash_size=20)
-                sample = image_cache[photo_url]
-                if np.count_nonzero(model != sample) <= 0:
-                    return self.id_return(photo, data)
-            return False
-        return False
+    def hash_from_disk(self, photo: str | dict, data: json) -> dict[str, str]:
+        """Opens locally stored sample of post and returns its hashes"""
+        return picture_hashes(self.opener.open(self.set_photo_url(photo, data)))
 
     @staticmethod
-    def find_images_of_same_size(data: json, img_width: str, img_height: str) -> list:
-        """Returns a list of images with the specified size present in the database"""
+    def has_all_hashes(post: dict) -> bool:
+        """Checks if document of post already has every hash of cascade"""
+        return all(post.get(x) is not None for x in HASH_FIELDS)
+
+    def stored_hashes(self, photo: str | dict, data: json) -> dict[str, str]:
+        """Returns hashes, stored next to post. \n
+        Posts, which were saved before hashes was introduced and missed by backfill,
+        hashed here once and their hashes stored as well"""
+        if data is db and self.has_all_hashes(photo):
+            return {x: photo[x] for x in HASH_FIELDS}
+        hashes = self.hash_from_disk(photo, data)
         if data is db:
-            return db.posts.find({'width': img_width, 'height': img_height})
-        else:
-            return [x['photo'] for x in
-                    [y for y in data['messages'] if y.get('width') is not None and y.get('photo') is not None] if
-                    x['width'] == img_width and x['height'] == img_height]
+            photo.update(hashes)
+            db.posts.update_one({'_id': photo['_id']}, {'$set': hashes})
+        return hashes
+
+    @staticmethod
+    def stored_fingerprint(post: dict) -> Optional[list[int]]:
+        """Returns hashes of sampled frames, stored next to animation or video post"""
+        return hex_to_fingerprint(post['frames']) if post.get('frames') else None
+
+    @staticmethod
+    def exact_keys(post: dict) -> tuple[str, ...]:
+        """Returns exact keys of file, stored next to post"""
+        return tuple(post[x] for x in EXACT_FIELDS if post.get(x))
+
+    def unindexed_posts(self) -> list[IndexedPost]:
+        """Returns posts, which are not in indexes yet"""
+        if type(self._dir_path) is str:
+            archive = self.archive
+            return [IndexedPost((dhash, phash, int.from_bytes(packed_hash.tobytes(), 'big')), post_id,
+                                keys=(digest.tobytes().hex(),))
+                    for post_id, dhash, phash, packed_hash, digest in zip(
+                        archive['id'].tolist(), archive['dhash'].tolist(), archive['phash'].tolist(),
+                        archive['hash'], archive['sha256'])]
+        posts = []
+        last_post_id = self._last_post_id
+        for post in self._dir_path.posts.find(self.unindexed_query()).sort('_id', 1):
+            last_post_id = post['_id']
+            try:
+                hashes = self.stored_hashes(post, self._dir_path)
+            except OSError:  # picture is missing or broken, it's marked as failed like backfill does
+                self._dir_path.posts.update_one({'_id': post['_id']}, {'$set': {'hash_failed': True}})
+                continue
+            posts.append(IndexedPost(hashes_to_ints(hashes), post['id'], self.stored_fingerprint(post),
+                                     self.exact_keys(post)))
+        self._last_post_id = last_post_id  # moved only when all posts are read, failed read is repeated
+        return posts
 
-    def compare_image(self, image: bytes | str, saved_data: json) -> bool | str:
-        """Performs search of similar images within specifed json file (chat log from telegramm)"""
-        sample_image_model = Image.open(image)
-        width, height = sample_image_model.size
-        imgs_with_same_size = self.find_images_of_same_size(saved_data, width, height)
-        return self.hash_compare(sample_image_model, imgs_with_same_size, saved_data)
+    def unindexed_query(self) -> dict:
+        """Returns query of posts created after last indexed one. Posts, which pictures can't be hashed, skipped"""
+        query = {'hash_failed': {'$ne': True}}
+        if self._last_post_id is not None:
+            query['_id'] = {'$gt': self._last_post_id}
+        return query
+
+    def update_index(self) -> None:
+        """Adds new posts to near-duplicate index. \n
+        Chat export never changes, so it is read only once,
+        database is asked for posts created after last indexed one on every call.
+        Indexes are created only after posts are loaded, so failed load is repeated by next call"""
+        if self._index is not None and type(self._dir_path) is str:
+            return
+        posts = self.unindexed_posts()
+        if self._index is None:
+            self.create_index()
+        self.index_posts(posts)
+
+    def create_index(self) -> None:
+        """Creates empty near-duplicate, clips and exact indexes"""
+        self._index = CascadeIndex(self.radii[0], self.radii[1:], SHORTLIST_SIZE, INDEX_CHUNKS, self.scan)
+        self._clips = SequenceIndex(FRAME_RADIUS, MIN_MATCHED_FRAMES, FRAME_OFFSET, INDEX_CHUNKS)
+        self._exact = {}
+
+    def index_posts(self, posts: list[IndexedPost]) -> None:
+        """Adds hashes and ids of posts to near-duplicate index, frames fingerprints to index of clips,
+        exact keys of files to exact index"""
+        self._index.add_many([(post.hashes[0], post.hashes[1:], post.id) for post in posts])
+        for post in posts:
+            if post.frames:
+                self._clips.add(post.frames, post.id)
+            for key in post.keys:
+                self._exact.setdefault(key, post.id)  # first post with this file is the original one
+
+    def search(self, model_hashes: tuple[int, ...], first_only: bool = False) -> list[tuple[int, Any]]:
+        """Returns dHash distances and ids of stored posts, which passed all stages of cascade"""
+        return self._index.search(model_hashes[0], model_hashes[1:], first_only)
+
+    def similar_posts(self, model_hashes: tuple[int, ...]) -> list[tuple[int, Any]]:
+        """Returns dHash distances and ids of all stored posts similar to picture, closest first"""
+        self.update_index()
+        return self.search(model_hashes)
+
+    def find_similar(self, model_hashes: tuple[int, ...]) -> bool | str:
+        """Returns id of most similar stored post, if any of them passes all stages of cascade,
+        otherwise returns False"""
+        self.update_index()
+        matches = self.search(model_hashes, first_only=True)
+        if matches:
+            return matches[0][1]
+        return False
+
+    async def async_unindexed_posts(self) -> list[IndexedPost]:
+        """Same as unindexed_posts, but doesn't block event loop: database is queried with motor,
+        packed archive is loaded and posts without stored hash are hashed in executor"""
+        loop = asyncio.get_running_loop()
+        if type(self._dir_path) is str:
+            return await loop.run_in_executor(None, self.unindexed_posts)
+        posts = []
+        last_post_id = self._last_post_id
+        async for post in async_db.posts.find(self.unindexed_query()).sort('_id', 1):
+            last_post_id = post['_id']
+            if not self.has_all_hashes(post):
+                try:
+                    hashes = await loop.run_in_executor(None, self.hash_from_disk, post, db)
+                except OSError:
+                    await async_db.posts.update_one({'_id': post['_id']}, {'$set': {'hash_failed': True}})
+                    continue
+                post.update(hashes)
+                await async_db.posts.update_one({'_id': post['_id']}, {'$set': hashes})
+            posts.append(IndexedPost(hashes_to_ints(post), post['id'], self.stored_fingerprint(post),
+                                     self.exact_keys(post)))
+        self._last_post_id = last_post_id
+        return posts
+
+    @property
+    def index_lock(self) -> asyncio.Lock:
+        if self._index_lock is None:
+            self._index_lock = asyncio.Lock()
+        return self._index_lock
+
+    async def async_update_unlocked(self) -> None:
+        if self._index is not None and type(self._dir_path) is str:
+            return
+        posts = await self.async_unindexed_posts()
+        if self._index is None:
+            self.create_index()
+        self.index_posts(posts)
+
+    async def async_update_index(self) -> None:
+        """Same as update_index for calls from event loop. Concurrent calls wait for each other,
+        so new posts not added to index twice"""
+        async with self.index_lock:
+            await self.async_update_unlocked()
+
+    async def async_search_in_executor(self, search: Callable, *args) -> Any:
+        """Updates indexes and runs search over them in executor. Index lock is held till search is over,
+        so posts aren't added to index, while search in other thread reads it"""
+        async with self.index_lock:
+            await self.async_update_unlocked()
+            return await asyncio.get_running_loop().run_in_executor(None, search, *args)
+
+    async def async_find_similar(self, model_hashes: tuple[int, ...]) -> bool | str:
+        """Same as find_similar, but doesn't block event loop"""
+        matches = await self.async_search_in_executor(self.search, model_hashes, True)
+        if matches:
+            return matches[0][1]
+        return False
+
+    async def async_find_exact(self, keys: tuple[str, ...]) -> bool | str:
+        """Returns id of stored post with the same file (by any of exact keys), otherwise returns False"""
+        await self.async_update_index()
+        for key in keys:
+            if key in self._exact:
+                return self._exact[key]
+        return False
+
+    async def async_find_similar_clip(self, frames: list[int]) -> bool | str:
+        """Returns id of stored animation or video post with fingerprint similar to given frames,
+        otherwise returns False"""
+        matches = await self.async_search_in_executor(lambda: self._clips.search(frames))
+        if matches:
+            return matches[0][1]
+        return False
 
     def db_check(self, image: bytes | str) -> bool | str:
-        """This function provides ability to swich search of similar images between locally stored jsons and
-        database with ip-adress.
-        """
+        """Performs search of similar images within chat export or database with ip-adress,
+        no matter of size of stored images"""
+        return self.find_similar(hashes_to_ints(picture_hashes(image)))
+
+    def pending_posts(self) -> list[tuple[Any, str]]:
+        """Returns keys (message id or document id) and paths to pictures of posts, which have no hashes yet"""
         if type(self._dir_path) is str:
             with open(f'{self._dir_path}/result.json', encoding='utf-8') as file:
                 saved_data = json.load(file)
-                compairing_result = self.compare_image(image, saved_data)
-        else:
-            saved_data = self._dir_path
-            compairing_result = self.compare_image(image, saved_data)
+            known_ids = set(self.load_packed()['id'].tolist()) | set(self.load_failed().tolist())
+            return [(x['id'], self.opener.path(x['photo'])) for x in saved_data['messages']
+                    if x.get('photo') is not None and x['id'] not in known_ids]
+        query = {'$or': [{x: {'$exists': False}} for x in HASH_FIELDS], 'hash_failed': {'$ne': True}}
+        return [(x['_id'], self.opener.path(x['src'])) for x in self._dir_path.posts.find(query, {'src': True})]
 
-        return compairing_result
+    def store_hashes(self, hashed: list[tuple[Any, dict[str, str]]], failed: list[Any] = ()) -> None:
+        """Writes down computed hashes: writes records as new chunk of packed archive or updates documents
+        in one bulk. Keys of pictures, which failed to hash, are written down as well"""
+        if type(self._dir_path) is str:
+            if hashed:
+                new_records = np.array([self.archive_record(*x) for x in hashed], dtype=archive_dtype)
+                self.save_atomic(f'{self._dir_path}/{ARCHIVE_PART.format(len(self.part_paths()))}', new_records)
+            if failed:
+                self.save_atomic(self.failed_path, np.union1d(self.load_failed(), np.array(failed, dtype='<i8')))
+            return
+        # files of posts are resized copies, so their SHA-256 is not the one of posted file
+        updates = [UpdateOne({'_id': key}, {'$set': {x: hashes[x] for x in HASH_FIELDS}}) for key, hashes in hashed]
+        updates += [UpdateOne({'_id': key}, {'$set': {'hash_failed': True}}) for key in failed]
+        if updates:
+            self._dir_path.posts.bulk_write(updates)
+
+    def backfill(self, mapper: Callable = map, chunk_size: int = BACKFILL_CHUNK) -> int:
+        """Computes and stores hashes for all posts, which were saved without them.
+        Results are written after every chunk (chat export chunks go to separate files, merged into archive
+        at the end), so interrupted backfill continues from last written chunk and rerun processes only
+        new messages or posts. Pictures, which can't be hashed, are written down and not tried again. \n
+        mapper: map-like function to hash pictures with, for example map of process pool.
+        Returns count of hashed pictures"""
+        pending = self.pending_posts()
+        hashed_count = 0
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            hashes = list(mapper(hash_file, [path for _, path in chunk]))
+            hashed = [(key, x) for (key, _), x in zip(chunk, hashes) if x is not None]
+            self.store_hashes(hashed, [key for (key, _), x in zip(chunk, hashes) if x is None])
+            hashed_count += len(hashed)
+        if type(self._dir_path) is str:
+            self.merge_archive()  # archive is also marked as up to date with export
+        return hashed_count
 
 
 def common_result(results: list) -> bool | str:
@@ -128,15 +456,65 @@ def common_result(results: list) -> bool | str:
             return False
 
 
+# comparsers created once, so packed archives and indexes stays in memory between checks
+comparser_for_broken_nest_db = IsPictureAlreadyPosted(
+    'C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-09',
+    ImageOpener('C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-09'))
+comparser_for_anal_carnaval_db = IsPictureAlreadyPosted(
+    'C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-31',
+    ImageOpener('C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-31', True))
+comparser_for_bot = IsPictureAlreadyPosted(db, opener=ImageOpener(None))
+comparsers = [comparser_for_broken_nest_db, comparser_for_anal_carnaval_db, comparser_for_bot]
+
+
 def is_pic_already_posted_check(image: bytes | str) -> bool | str:
     """performs search for similar pictures like specifed pic in all types of databases"""
-    comparser_for_broken_nest_db = IsPictureAlreadyPosted(
-        'C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-09',
-        ImageOpener('C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-09'))
-    comparser_for_anal_carnaval_db = IsPictureAlreadyPosted(
-        'C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-31',
-        ImageOpener('C:/Users/sabla/Downloads/Telegram Desktop/ChatExport_2021-07-31', True))
-    comparser_for_bot = IsPictureAlreadyPosted(db, opener=ImageOpener(None))
-    comparsers = [comparser_for_broken_nest_db, comparser_for_anal_carnaval_db, comparser_for_bot]
-    results = [x.db_check(image) for x in comparsers]
+    model_hashes = hashes_to_ints(picture_hashes(image))
+    results = [x.find_similar(model_hashes) for x in comparsers]
     return common_result(results)
+
+
+async def async_is_pic_already_posted_check(image: bytes | str) -> bool | str:
+    """Non-blocking version of is_pic_already_posted_check for bot handlers:
+    incoming picture hashed in executor, then all types of databases searched concurrently"""
+    hashes = await asyncio.get_running_loop().run_in_executor(None, picture_hashes, image)
+    model_hashes = hashes_to_ints(hashes)
+    results = await asyncio.gather(*[x.async_find_similar(model_hashes) for x in comparsers])
+    return common_result(list(results))
+
+
+async def async_is_file_already_posted_check(*keys: Optional[str]) -> bool | str:
+    """Searches for posts of exactly the same file by telegram file_unique_id and (or) SHA-256 of content.
+    Doesn't need file itself, so forwards and re-sends are caught before download and decoding"""
+    keys = tuple(x for x in keys if x)
+    if not keys:
+        return False
+    results = await asyncio.gather(*[x.async_find_exact(keys) for x in comparsers])
+    return common_result(list(results))
+
+
+async def async_is_clip_already_posted_check(clip: BytesIO | str) -> bool | str:
+    """Searches for posted animations and videos like specifed clip by hashes of its sampled frames,
+    which are computed in executor"""
+    frames = await asyncio.get_running_loop().run_in_executor(None, clip_fingerprint, clip)
+    if not frames:
+        return False
+    results = await asyncio.gather(*[x.async_find_similar_clip(frames) for x in comparsers])
+    return common_result(list(results))
+
+
+def load_hash_indexes() -> None:
+    """Maps packed archives and builds near-duplicate indexes for all comparsers, called at bot startup.
+    Source, which fails to load, doesn't stop bot: its indexes are built again by first check"""
+    for comparser in comparsers:
+        try:
+            comparser.update_index()
+        except (OSError, ValueError) as error:
+            print(f'indexes of {comparser._dir_path} not loaded: {error!r}')
+
+
+def backfill_hashes(mapper: Callable = map, chunk_size: int = BACKFILL_CHUNK) -> list[int]:
+    """Stores hashes for old posts in all types of databases, so checks dont need to open their pictures.
+    Returns count of hashed pictures for every database"""
+    return [comparser.backfill(mapper, chunk_size) for comparser in comparsers]
+
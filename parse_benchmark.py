@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+from typing import Callable
+
+from bs4 import BeautifulSoup as bs
+
+from parsers.imageboards_parsers import ImageboardParser, ParsersHandler
+
+"""Command-line tool to compare parsing of saved imageboard pages as whole tree (as it was done before)
+and with strainer of site (only parts with tags). Prints time and peak memory of both ways per page
+and checks, that both ways give the same tags.
+
+    python parse_benchmark.py danbooru saved/danbooru_1.html saved/danbooru_2.html --repeat 20
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compares whole tree and strained parsing of imageboard pages')
+    parser.add_argument('site', choices=list(ParsersHandler.class_dict), help='imageboard, pages were saved from')
+    parser.add_argument('pages', nargs='+', help='saved html pages of posts')
+    parser.add_argument('--repeat', type=int, default=10, help='count of runs to average time over')
+    return parser.parse_args()
+
+
+def parse_tags(site: str, soup_maker: Callable[[ImageboardParser, str], bs], page: str) -> dict:
+    """Parses page with soup maker and returns found tags"""
+    parser = ParsersHandler.class_dict[site](None)
+    parser.extract_soup_to_attrs(soup_maker(parser, page))
+    parser.remove_all_unnesessary_parsed_info()
+    return ParsersHandler.board_tags(parser)
+
+
+def measure(site: str, soup_maker: Callable[[ImageboardParser, str], bs], page: str,
+            repeat: int) -> tuple[float, float, dict]:
+    """Returns average time in ms, peak memory in MB and tags"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse_tags(site, soup_maker, page)
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    tracemalloc.start()
+    tags = parse_tags(site, soup_maker, page)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return elapsed, peak, tags
+
+
+def main() -> None:
+    args = parse_args()
+    ways = {
+        'whole tree': lambda parser, page: bs(page, features='lxml'),
+        'strained': lambda parser, page: parser.make_soup(page),
+    }
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8') as file:
+            page = file.read()
+        print(f'{path} ({len(page) // 1024} KB)')
+        results = {name: measure(args.site, way, page, args.repeat) for name, way in ways.items()}
+        for name, (elapsed, peak, _) in results.items():
+            print(f'    {name:>10}: {elapsed:8.2f} ms {peak:8.2f} MB')
+        whole, strained = (x[2] for x in results.values())
+        if whole != strained:
+            print('    tags differ!', whole, strained, sep='\n    ')
+
+
+if __name__ == '__main__':
+    main()
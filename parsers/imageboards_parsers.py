@@ -4,16 +4,29 @@ import typing
 
 import asyncio
 import dataclasses
+import html
 import json
+import re
+import time
+import xml.etree.ElementTree as ET
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field, fields
 from os import environ as venv
 from string import printable
 
 import httpx
-from bs4 import BeautifulSoup as bs, BeautifulSoup
+from bs4 import BeautifulSoup as bs, BeautifulSoup, SoupStrainer
 from pixivpy_async import AppPixivAPI, PixivClient
 
+from core.http_clients import http_clients
+
+BOARD_TIMEOUT = 15  # seconds, site which doesn't answer in time is dropped from search
+SEARCH_BUDGET = 25  # seconds for all sites, search doesn't wait for the rest of them after that
+PARSE_WORKERS = 2  # processes, parsing html pages of sites
+PIXIV_TOKEN_MARGIN = 5 * 60  # seconds, access token of pixiv is refreshed this long before it expires
+
 imageboards_html_tags = {  # flags for parsing, see Imageboard Parser below for more info
     'Booru': {
         'fandom': {'class': "tag-type-copyright"},
@@ -47,6 +60,24 @@ imageboards_html_tags = {  # flags for parsing, see Imageboard Parser below for
 }
 
 
+def compile_strainer(scheme: dict[str, dict]) -> typing.Optional[SoupStrainer]:
+    """Turns scheme of site from imageboards_html_tags into filter for lxml parser.
+    Parser keeps only elements, matching any category of scheme, with all their content, so findAll
+    by scheme works on filtered soup the same way as on whole page. \n
+    Schemes by css class are matched exactly, schemes by presence of attributes are matched by attributes,
+    which all categories require, and narrowed down by findAll later. If there are no such, page is parsed whole"""
+    specs = list(scheme.values())
+    if all(set(x) == {'class'} for x in specs):
+        classes = '|'.join(re.escape(x['class']) for x in specs)
+        # class is matched while parsing, when it is still raw string with all classes of element
+        return SoupStrainer(attrs={'class': re.compile(rf'(?:^|\s)(?:{classes})(?:\s|$)')})
+    required = set.intersection(*[{key for key, val in x.items() if val is True} for x in specs])
+    return SoupStrainer(attrs=dict.fromkeys(required, True)) if required else None
+
+
+imageboards_strainers = {name: compile_strainer(scheme) for name, scheme in imageboards_html_tags.items()}
+
+
 class ABC_Imageboard_Parser(ABC):
     """
     This is the skeleton of a template for parsing an imageboards according to the following scheme:
@@ -93,19 +124,41 @@ class ImageboardParser(ABC_Imageboard_Parser):  # tags from picture description
     artist: list = field(default=None, init=False)  # creator of picture
     character: list = field(default=None, init=False)  # charater(s) on pic
     tags: list = field(default=None, init=False)  # various details like clothing and etc
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = ()  # ids of Sauce NAO indexes, which contain posts of site
+
+    @classmethod
+    def html_scheme(cls) -> str:
+        """Name of scheme of site in imageboards_html_tags, API parsers use scheme of their html base"""
+        return next((x.__name__ for x in cls.__mro__ if x.__name__ in imageboards_html_tags), 'Booru')
+
+    @property
+    def strainer(self) -> typing.Optional[SoupStrainer]:
+        """Filter, which leaves only parts of page with tags, see compile_strainer"""
+        return imageboards_strainers[self.html_scheme()]
+
+    def make_soup(self, page: str | bytes) -> BeautifulSoup:
+        """parses only parts of page, which contain tags"""
+        return bs(page, features='lxml', parse_only=self.strainer)
 
     def get_soup(self, session: any) -> BeautifulSoup:
-        """returns whole html of source page
+        """returns parsed html of source page
         depricated sync method"""
         link = self.url
         responce_text = session.get(link, verify=False).text
-        soup = bs(str(responce_text), features='lxml')
-        return soup
+        return self.make_soup(str(responce_text))
 
-    async def async_get_soup(self, session: any) -> BeautifulSoup:
+    async def async_get_page(self, session: any) -> str:
         """returns whole html of page asynchronously"""
         responce = await session.get(self.url)
-        return bs(responce.text, features='lxml')
+        return responce.text
+
+    async def async_get_soup(self, session: any) -> BeautifulSoup:
+        """returns parsed html of page asynchronously"""
+        return self.make_soup(await self.async_get_page(session))
+
+    async def async_get_content(self, session: any) -> str | dict:
+        """returns unparsed html of page or json from API, so parsing can be done out of event loop"""
+        return await self.async_get_page(session)
 
     @staticmethod
     def get_soup_from_file(file: bytes) -> BeautifulSoup:
@@ -152,7 +205,7 @@ class BooruParser(ImageboardParser):
         """Stories parts of html to cathegories attrs"""
         attrs = self.parsing_attrs_names
         for pos in attrs:
-            setattr(self, pos, self.parse_category_soup_fragmets(soup, self.__class__.__name__, pos))
+            setattr(self, pos, self.parse_category_soup_fragmets(soup, self.html_scheme(), pos))
 
     def booru_stripper(self, bs_with_tag) -> str:
         """Turns raw text from link into tag"""
@@ -168,6 +221,58 @@ class BooruParser(ImageboardParser):
             attribute_val[i] = self.booru_stripper(attribute_val[i])
 
 
+class PixivSession:
+    """
+    One logged in pixiv API session for whole bot. Access token is kept between requests and refreshed
+    when it is close to expire, so requests don't wait for login every time and don't load auth endpoint.
+    Refresh is done under lock: callers, which need token while it is refreshed, wait for that refresh
+    and don't log in by themselves
+
+    - margin: seconds before expiration, when token is refreshed
+    """
+
+    def __init__(self, margin: float = PIXIV_TOKEN_MARGIN):
+        self.margin = margin
+        self._client: typing.Optional[PixivClient] = None
+        self._api: typing.Optional[AppPixivAPI] = None
+        self._expires: float = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        """Checks if token can be used without refresh"""
+        return self._api is not None and time.monotonic() < self._expires - self.margin
+
+    async def async_refresh(self, stale_token: typing.Optional[str] = None) -> None:
+        """Gets new access token by refresh token. \n
+        If stale_token is given, token is refreshed even if it is fresh by time, but only if it wasn't
+        replaced by another caller already"""
+        async with self._lock:
+            if self._api is not None and (self._api.access_token != stale_token if stale_token else self.fresh):
+                return
+            if self._api is None:
+                self._client = PixivClient()
+                self._api = AppPixivAPI(client=self._client.start())
+            token = await self._api.login(refresh_token=self._api.refresh_token or venv['PIXIV_TOKEN'])
+            self._expires = time.monotonic() + int(token.response.get('expires_in', 3600))
+
+    async def async_api(self) -> AppPixivAPI:
+        """Returns logged in API, refreshes token first if it is going to expire"""
+        if not self.fresh:
+            await self.async_refresh()
+        return self._api
+
+    async def async_close(self) -> None:
+        """Closes connections of session, called at bot shutdown"""
+        if self._client is not None:
+            await self._client.close()
+        self._client = self._api = None
+        self._expires = 0
+
+
+pixiv_session = PixivSession()
+
+
 @dataclass
 class Pixiv(ImageboardParser):
     """Unlike other parsers, this one using special api
@@ -175,6 +280,7 @@ class Pixiv(ImageboardParser):
     so the part of basic methods is useless
     but still implemente, which allows to use it as other parsers
     and avoid errors"""
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = (5, 6)  # pixiv and pixiv historical
 
     def description_cleaner(self, bs_with_tag) -> None:
         return None
@@ -193,13 +299,19 @@ class Pixiv(ImageboardParser):
             splited_url = self.url.rsplit('/', maxsplit=1)
             return splited_url[1]
 
+    async def async_get_content(self, session: any) -> dict:
+        return await self.async_get_soup(session)
+
     async def async_get_soup(self, session: any) -> dict:
-        """gets json from API"""
-        async with PixivClient() as client:
-            api = AppPixivAPI(client=client)
-            await api.login(refresh_token=venv['PIXIV_TOKEN'])
+        """gets json from API with shared session. If pixiv rejects token before its time,
+        token is refreshed and request is repeated once"""
+        api = await pixiv_session.async_api()
+        token = api.access_token
+        result = await api.illust_detail(self.id_get())
+        if 'oauth' in str(result.get('error', {}).get('message', '')).lower():
+            await pixiv_session.async_refresh(stale_token=token)
             result = await api.illust_detail(self.id_get())
-            return result
+        return result
 
     @staticmethod
     def pixiv_artist(illust_detail) -> list[str]:
@@ -262,6 +374,7 @@ class Pixiv(ImageboardParser):
 
 @dataclass
 class Gelbooru(BooruParser):
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = (25,)
 
     def booru_stripper(self, bs_with_tag: BeautifulSoup) -> str:
         """Turns raw text from link into tag"""
@@ -275,6 +388,7 @@ class Gelbooru(BooruParser):
 
 @dataclass
 class Danbooru(BooruParser):
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = (9,)
 
     def fill_class_attributes(self, session: any) -> None:
         soup = self.get_soup(session)
@@ -292,7 +406,7 @@ class Danbooru(BooruParser):
 
     def extract_soup_to_attrs(self, soup: BeautifulSoup) -> None:
         for attr_name in self.parsing_attrs_names:
-            soup_fragments = self.parse_category_soup_fragmets(soup, self.__class__.__name__, attr_name)
+            soup_fragments = self.parse_category_soup_fragmets(soup, self.html_scheme(), attr_name)
             self.original_character_case(attr_name, soup_fragments)
 
     def description_cleaner(self, attribute_val: list) -> None:
@@ -310,6 +424,8 @@ class Danbooru(BooruParser):
 
 @dataclass
 class Yandere(BooruParser):
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = (12,)
+
     def __init__(self, url):
         super(Yandere, self).__init__(url)
 
@@ -323,6 +439,8 @@ class Yandere(BooruParser):
 
 @dataclass
 class Sankaku(BooruParser):
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = (27,)
+
     def __init__(self, url):
         super(Sankaku, self).__init__(url)
 
@@ -334,6 +452,8 @@ class Sankaku(BooruParser):
 
 @dataclass
 class AnimePictures(BooruParser):
+    nao_indexes: typing.ClassVar[tuple[int, ...]] = (28,)
+
     def __init__(self, url):
         super(AnimePictures, self).__init__(url)
 
@@ -408,9 +528,11 @@ class Reactor(ImageboardParser):
                    'Игровая эротика',
                    'арт барышня (арт девушка, art барышня, art девушка,)', 'naruto porn', 'Witcher Персонажи']
 
-    async def async_get_soup(self, session: any) -> BeautifulSoup:
+    strainer = compile_strainer({'tags': {'class': 'post_description'}})
+
+    async def async_get_page(self, session: any) -> str:
         responce = await session.get(self.url, params={'proxy': 'None'})
-        return bs(responce.text, features='lxml')
+        return responce.text
 
     def extract_soup_to_attrs(self, soup: BeautifulSoup | bs.NavigableString) -> None:
         self.tags = soup.find(attrs={'class': "post_description"}, text=True)
@@ -429,70 +551,279 @@ class Thatpervert(Reactor):
         super(Thatpervert, self).__init__(url, artist, tags)
 
 
+class ApiParser(ABC):
+    """Part of parser, which gets post from API of site instead of html page, like Pixiv does.
+    Response is several times smaller than page and has tags already split by categories,
+    so it is parsed without soup and cleaning. If API fails, parser falls back to html page of its base class. \n
+    Used as first base of parsers below, second base is html parser of the same site"""
+    id_pattern: typing.ClassVar[str] = r'/(\d+)'  # id of post in link from Sauce NAO
+    tag_types: typing.ClassVar[dict[str, str]] = {}  # types of tags in API response to categories of parser
+    api_errors = (httpx.HTTPError, ValueError, LookupError, TypeError, ET.ParseError)
+    from_api: bool = False
+
+    @property
+    def site(self) -> str:
+        url = httpx.URL(self.url)
+        return f'{url.scheme}://{url.host}'
+
+    def post_id(self) -> str:
+        return re.findall(self.id_pattern, self.url)[-1]
+
+    @staticmethod
+    def to_tag(name: str) -> str:
+        """API returns tags as they are in search, page shows them with spaces"""
+        return html.unescape(name).replace('_', ' ')
+
+    def categorize(self, names: typing.Iterable[str], types: dict) -> dict[str, list[str]]:
+        """Splits tags of post into categories by their types. Tags of unknown type are general ones,
+        tags of types, which are not parsed from page either (meta, faults), are dropped"""
+        categories = {x: [] for x in self.parsing_attrs_names}
+        for name in names:
+            category = self.tag_types.get(str(types.get(name, '0')))
+            if category is not None:
+                categories[category].append(self.to_tag(name))
+        return categories
+
+    @staticmethod
+    async def async_get_json(session: httpx.AsyncClient, url: str, **params) -> typing.Any:
+        responce = await session.get(url, params=params)
+        responce.raise_for_status()
+        return responce.json()
+
+    @abstractmethod
+    async def async_get_api_tags(self, session: httpx.AsyncClient) -> dict[str, list[str]]:
+        pass
+
+    async def async_get_soup(self, session: any) -> dict | BeautifulSoup:
+        """gets tags from API, or whole html of page if API fails"""
+        try:
+            return await self.async_get_api_tags(session)
+        except self.api_errors:
+            return await super().async_get_soup(session)
+
+    async def async_get_content(self, session: any) -> dict | str:
+        """gets tags from API, or unparsed html of page if API fails"""
+        try:
+            return await self.async_get_api_tags(session)
+        except self.api_errors:
+            return await super().async_get_content(session)
+
+    def extract_soup_to_attrs(self, soup: dict | BeautifulSoup) -> None:
+        self.from_api = isinstance(soup, dict)
+        if self.from_api:
+            for attr_name in self.parsing_attrs_names:
+                setattr(self, attr_name, soup[attr_name])
+        else:
+            super().extract_soup_to_attrs(soup)
+
+    def remove_all_unnesessary_parsed_info(self) -> None:
+        """tags from API are clean already"""
+        if not self.from_api:
+            super().remove_all_unnesessary_parsed_info()
+
+
+class DanbooruApi(ApiParser, Danbooru):
+    fields_of_categories = {
+        'fandom': 'tag_string_copyright',
+        'artist': 'tag_string_artist',
+        'character': 'tag_string_character',
+        'tags': 'tag_string_general',
+    }
+
+    async def async_get_api_tags(self, session: httpx.AsyncClient) -> dict[str, list[str]]:
+        """posts/<id>.json has separate string of tags for every category"""
+        post = await self.async_get_json(session, f'{self.site}/posts/{self.post_id()}.json')
+        return {x: [self.to_tag(y) for y in post[key].split()] for x, key in self.fields_of_categories.items()}
+
+
+class DapiParser(ApiParser):
+    """API of Gelbooru and sites on its engine: post has only plain string of tags,
+    their types are requested by second call with all names of post at once"""
+    id_pattern = r'[?&]id=(\d+)'
+    tag_types = {'0': 'tags', '1': 'artist', '3': 'fandom', '4': 'character'}
+
+    async def async_get_api_tags(self, session: httpx.AsyncClient) -> dict[str, list[str]]:
+        api_url = f'{self.site}/index.php'
+        posts = await self.async_get_json(session, api_url, page='dapi', s='post', q='index', json=1,
+                                          id=self.post_id())
+        if isinstance(posts, dict):  # gelbooru wraps posts, other sites return bare list
+            posts = posts['post']
+        names = posts[0]['tags'].split()
+        responce = await session.get(api_url, params={'page': 'dapi', 's': 'tag', 'q': 'index',
+                                                      'names': ' '.join(names), 'limit': len(names)})
+        responce.raise_for_status()
+        # tag api has no json on some sites, fields of tags are attributes or child nodes depending on engine
+        types = {x.get('name') or x.findtext('name'): x.get('type') or x.findtext('type')
+                 for x in ET.fromstring(responce.content).iter('tag')}
+        return self.categorize(names, types)
+
+
+class GelbooruApi(DapiParser, Gelbooru):
+    pass
+
+
+class Rule34Api(DapiParser, Rule34):
+    pass
+
+
+class XbooruApi(DapiParser, Xbooru):
+    pass
+
+
+class YandereApi(ApiParser, Yandere):
+    tag_types = {'general': 'tags', 'artist': 'artist', 'copyright': 'fandom', 'character': 'character'}
+
+    async def async_get_api_tags(self, session: httpx.AsyncClient) -> dict[str, list[str]]:
+        """post.json of 2 version returns types of tags of found posts along with them"""
+        result = await self.async_get_json(session, f'{self.site}/post.json', tags=f'id:{self.post_id()}',
+                                           api_version=2, include_tags=1)
+        return self.categorize(result['posts'][0]['tags'].split(), result['tags'])
+
+
 class ParsersHandler:  # in sauce_nao_operations almost same dict used to store links
     # there imageboard names are lowercase to check their precense in urls
     class_dict = {
-        'yande.re': Yandere,
+        'yande.re': YandereApi,
         'pixiv': Pixiv,
-        'gelbooru': Gelbooru,
-        'danbooru': Danbooru,
+        'gelbooru': GelbooruApi,
+        'danbooru': DanbooruApi,
         'thatpervert': Thatpervert,
         'reactor': Reactor,
-        'rule34': Rule34,
+        'rule34': Rule34Api,
         'chan.sankaku': Sankaku,
-        'xbooru': Xbooru,
+        'xbooru': XbooruApi,
         'anime-pictures': AnimePictures,
     }
 
-    def generate_parsers(self, urls: dict) -> list:  #
-        """initializase parsers according to  parsed links from sauce nao"""
-        return [self.class_dict[x](urls[x]) for x in self.class_dict if urls[x] is not None]
-
-    @staticmethod
-    async def async_call_to_imageboards(parsers: list) -> tuple:
-        """Gets soups for allactual parsers asynchronously"""
-        proxyes = {
-            'https://': venv['PROXY'],
-            'http://': venv['PROXY']
-        }
+    @classmethod
+    def nao_indexes(cls) -> set[int]:
+        """Returns ids of Sauce NAO indexes, which results can be parsed by registered parsers. \n
+        Sites without own index (rule34, xbooru, reactor) still get links from results of other indexes"""
+        return {x for parser in cls.class_dict.values() for x in parser.nao_indexes}
 
-        async with httpx.AsyncClient(proxies=proxyes, follow_redirects=True) as sess:
-            soups = await asyncio.gather(*[x.async_get_soup(sess) for x in parsers])
-        return soups
+    def generate_named_parsers(self, urls: dict, skip: typing.Container[str] = ()) -> dict[str, ImageboardParser]:
+        """Initializes parsers according to parsed links from sauce nao, named by imageboards.
+        Skipped imageboards are left out"""
+        return {x: self.class_dict[x](urls[x]) for x in self.class_dict if urls.get(x) is not None and x not in skip}
 
     @staticmethod
-    def extract_soups(soups: typing.Iterable, parsers: list) -> None:
-        """Stores html fragments to attrs of actual parsers"""
-        for soup in soups:
-            parsers[soups.index(soup)].extract_soup_to_attrs(soup)
+    async def async_parse_board(parser: ImageboardParser, timeout: float = BOARD_TIMEOUT) -> dict:
+        """Full cycle for single site: gets page and parses it in parse_pool. Deadline of site covers both,
+        asyncio.TimeoutError is risen if site isn't parsed in time.
+        Requests go through shared client, so connections to proxy and sites are reused between searches. \n
+        Returns found tags"""
+        async def fetch_and_parse() -> dict:
+            content = await parser.async_get_content(http_clients.boards)
+            return await parse_pool.async_parse(parser, content)
+        return await asyncio.wait_for(fetch_and_parse(), timeout)
+
+    @classmethod
+    async def async_stream_imageboards(cls, parsers: dict[str, ImageboardParser], budget: float = SEARCH_BUDGET
+                                       ) -> typing.AsyncIterator[tuple[str, dict | Exception]]:
+        """Yields names of sites with their tags as soon as they are parsed, or with errors if they fail.
+        Every site is fetched and parsed by its own task, so parsing of one site overlaps with network of others.
+        Sites, which aren't parsed when budget is over, are cancelled and yielded with asyncio.TimeoutError,
+        so search waits no longer than budget, however slow the slowest site is"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        tasks = {asyncio.create_task(cls.async_parse_board(parser)): name for name, parser in parsers.items()}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    yield tasks[task], task.exception() or task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        for task in pending:
+            yield tasks[task], asyncio.TimeoutError(f'{tasks[task]} exceeded search budget')
 
     @staticmethod
-    def clean_all_parsed_tags(parsers: list) -> None:
-        """Turns raw text from links into tags for all actual parsers"""
-        for parser in parsers:
-            parser.remove_all_unnesessary_parsed_info()
+    def board_tags(parser: ImageboardParser) -> dict:
+        """Returns tags from single site, which were found"""
+        parsed = dataclasses.asdict(parser)
+        return {x: parsed[x] for x in parser.parsing_attrs_names if parsed[x] is not None}
 
-    @staticmethod
-    def compress_for_reduce(parsers: list, overall_output: dict) -> dict:
-        """Stores tags from all actual sites to unified form of dict"""
-        for parser in parsers:
-            for attr_name in [x for x in parser.parsing_attrs_names if dataclasses.asdict(parser)[x] is not None]:
-                overall_output[attr_name].append(dataclasses.asdict(parser)[attr_name])
-        return overall_output
 
+def parse_content(parser: ImageboardParser, content: str | dict) -> dict:
+    """Turns page or json from API into tags of site. Runs in processes of parse_pool, so gets parser's copy
+    and returns only tags"""
+    parser.extract_soup_to_attrs(parser.make_soup(content) if isinstance(content, str) else content)
+    parser.remove_all_unnesessary_parsed_info()
+    return ParsersHandler.board_tags(parser)
+
+
+class ParsePool:
+    """
+    Processes, which parse html pages of sites. Building soup of big page takes long enough
+    to delay updates of other users, so it is done out of event loop. Json from APIs is parsed in place,
+    it needs no soup
+
+    - workers: count of processes
+    """
+
+    def __init__(self, workers: int = PARSE_WORKERS):
+        self.workers = workers
+        self._pool: typing.Optional[ProcessPoolExecutor] = None
 
-async def parse_imageboards(urls: dict) -> dict:
-    """Performs full parsing cycle from links from Sauce NAO to tags"""
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def async_parse(self, parser: ImageboardParser, content: str | dict) -> dict:
+        """Same as parse_content, but pages are parsed in pool"""
+        if isinstance(content, dict):
+            return parse_content(parser, content)
+        pool = self.pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, parse_content, parser, content)
+        except BrokenProcessPool:  # worker died, pool is recreated for next pages
+            pool.shutdown(wait=False, cancel_futures=True)  # releases processes and queue of broken pool
+            if self._pool is pool:  # other parses could fail on the same pool and recreate it already
+                self._pool = None
+            raise
+
+    def close(self) -> None:
+        """Stops processes, called at bot shutdown"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+parse_pool = ParsePool()
+
+
+def merge_board_tags(boards: dict[str, dict]) -> dict:
+    """Stores tags from all parsed sites to unified form of dict, in order of sites in ParsersHandler"""
     common_dict_sample = {
         'fandom': [],
         'character': [],
         'artist': [],
         'tags': []
     }
+    for name in ParsersHandler.class_dict:
+        for attr_name, value in boards.get(name, {}).items():
+            common_dict_sample[attr_name].append(value)
+    return common_dict_sample
+
+
+async def parse_boards(urls: dict, parsed: typing.Optional[dict[str, dict]] = None) -> tuple[dict, list]:
+    """Parses sites, which are not parsed yet, for tags. Every site is parsed as soon as it answers. \n
+    Returns tags of every parsed site (including already parsed ones) and errors of sites, which failed
+    or didn't answer in time, so tags from successful sites aren't lost because of them"""
+    boards = dict(parsed or {})
     handler = ParsersHandler()
-    parsers = handler.generate_parsers(urls)
-    responces = await handler.async_call_to_imageboards(parsers)
-    handler.extract_soups(responces, parsers)
-    handler.clean_all_parsed_tags(parsers)
-    results = handler.compress_for_reduce(parsers, common_dict_sample)
-    return results
+    parsers = handler.generate_named_parsers(urls, skip=boards)
+    errors = []
+    async for name, tags in handler.async_stream_imageboards(parsers):
+        if isinstance(tags, Exception):
+            errors.append(tags)
+        else:
+            boards[name] = tags
+    return boards, errors
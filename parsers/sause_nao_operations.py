@@ -1,15 +1,31 @@
 from __future__ import annotations
 
+import asyncio
 import typing
 from abc import ABC, abstractmethod
 from collections.abc import Iterable
 from io import BytesIO
+from urllib.parse import urlencode
 
 import bs4
+import httpx
 import requests as req
 from bs4 import BeautifulSoup as bs, BeautifulSoup
 
 from core.exceptions import ErrorConnectToNAO
+from core.nao_scheduler import nao_scheduler
+from parsers.imageboards_parsers import ParsersHandler
+
+NAO_URL = 'http://saucenao.com/search.php'
+NAO_TIMEOUT = 30  # seconds, search of large picture at busy hours may take a while
+NAO_HIGH_SIMILARITY = 87  # results at least that similar are trusted, less similar used only if there is no such
+NAO_RETRIES = 3  # count of attempts of search, rejected by Sauce NAO because of rate limit
+NAO_INDEXES = ParsersHandler.nao_indexes()  # search only in indexes, which results can be parsed
+NAO_DBMASK = sum(1 << x for x in NAO_INDEXES)
+NAO_RESULTS_PER_INDEX = 2
+NAO_RESULTS_COUNT = NAO_RESULTS_PER_INDEX * len(NAO_INDEXES)
+NAO_SITE = 'https://saucenao.com'
+YANDEX_SEARCH_URL = 'https://yandex.com/images/search'
 
 links_to_imageboards = {
     'yande.re': None,
@@ -28,6 +44,33 @@ links_to_imageboards = {
 }
 
 
+class NaoResult:
+    """
+    Single result of Sauce NAO search, decoded from html cell or json once,
+    so later steps don't walk through the page again
+
+    - similarity: similarity of result and searched image in percents
+    - links: links to sources of result
+    - index_name: name of Sauce NAO index, result was found in (only known for json)
+    - creators: artist's nicknames from result
+    """
+    __slots__ = ('similarity', 'links', 'index_name', 'creators')
+
+    def __init__(self, similarity: float, links: list[str], index_name: typing.Optional[str] = None,
+                 creators: typing.Optional[list[str]] = None):
+        self.similarity = similarity
+        self.links = links
+        self.index_name = index_name
+        self.creators = creators or []
+
+    def __repr__(self) -> str:
+        return f'NaoResult({self.similarity}, {self.links}, {self.index_name!r}, {self.creators})'
+
+    def as_tuple(self) -> tuple:
+        """Packs similarity and links in tuple, the form parse_links_to_imageboards takes"""
+        return tuple([self.similarity, *self.links])
+
+
 class Parser(ABC):
     @abstractmethod
     def get_soup(self):
@@ -40,7 +83,7 @@ class SauseNaoParser:
         self.info: list = []
         self.file_path: str | BytesIO = file
         self.parsed_links: dict = parsed_links
-        self.session: req.Session = session
+        self.session: req.Session | httpx.AsyncClient = session
 
     @staticmethod
     def open_local_html(path: str) -> bytes:
@@ -48,15 +91,27 @@ class SauseNaoParser:
         with open(path, 'rb') as f:
             return f.read()
 
+    @property
+    def search_files(self) -> dict:
+        """Multipart body of search request with the image file attached"""
+        return {'file': ('1.jpg', self.file_path, 'image/jpg')}
+
     def get_soup(self) -> BeautifulSoup:  # parses whole html page.
         """Sends an HTTP POST request to saucenao.com with the image file attached,
         then parses the resulting HTML with BeautifulSoup."""
-        reverse_search_url = 'http://saucenao.com/search.php'
-        file = {'file': ('1.jpg', self.file_path, 'image/jpg')}
-        response = self.session.post(reverse_search_url, files=file, allow_redirects=True)
+        response = self.session.post(NAO_URL, files=self.search_files, allow_redirects=True)
         nao_soup = bs(response.content, 'lxml')
         return nao_soup
 
+    async def async_get_soup(self) -> BeautifulSoup:
+        """Same as get_soup, but doesn't block event loop: request sent with httpx.AsyncClient,
+        resulting HTML parsed in executor"""
+        try:
+            response = await self.session.post(NAO_URL, files=self.search_files, timeout=NAO_TIMEOUT)
+        except httpx.HTTPError:
+            raise ErrorConnectToNAO
+        return await asyncio.get_running_loop().run_in_executor(None, bs, response.content, 'lxml')
+
     @staticmethod
     def get_redirection_link(soup: BeautifulSoup) -> str:
         """Extracts a redirection link from the search result page,
@@ -118,27 +173,29 @@ class SauseNaoParser:
                 urls.append(url.get('href'))
         return urls
 
-    def pack_links_and_similarity_from_result_to_tuple(self, html_soup: BeautifulSoup) -> tuple:
-        """Extracts the similarity score and all links from a single search result, and returns them as a tuple."""
+    def decode_result(self, html_soup: BeautifulSoup) -> NaoResult:
+        """Extracts the similarity score, all links and artists from a single search result"""
         similarity = float(self.get_similarity_procent(html_soup))
         links_from_desc = self.get_links_from_sause_nao_soup(html_soup, 'resultmiscinfo')
         links_from_corner = self.get_links_from_sause_nao_soup(html_soup, 'resultcontentcolumn')
-        check_list = [similarity, *links_from_desc, *links_from_corner]
-        return tuple([x for x in check_list if x is not None])
+        links = [x for x in [*links_from_desc, *links_from_corner] if x is not None]
+        return NaoResult(similarity, links, creators=NAOArtistParser(self, []).get_artists([html_soup]))
+
+    def decode_table(self, nao_soup: BeautifulSoup) -> list[NaoResult]:
+        """Decodes every relevant result of search once, all later steps work with decoded results"""
+        return [self.decode_result(x) for x in self.get_table(nao_soup)]
 
-    def get_high_similar_results(self, html_soup: BeautifulSoup) -> list:
+    @staticmethod
+    def get_high_similar_results(table: list[NaoResult]) -> list:
         """Returns a list of tuples containing links from search results
          with a similarity score greater than or equal to 87%."""
-        soup_with_high_similarity = [x for x in html_soup if float(self.get_similarity_procent(x)) >= 87]
-        return [x for x in list(map(self.pack_links_and_similarity_from_result_to_tuple, soup_with_high_similarity)) if
-                len(x) > 1]
+        return [x.as_tuple() for x in table if x.similarity >= NAO_HIGH_SIMILARITY and x.links]
 
-    def get_less_similar_results(self, html_soup: BeautifulSoup) -> list:
+    @staticmethod
+    def get_less_similar_results(table: list[NaoResult]) -> list:
         """Returns a list of tuples containing links
          from search results with a similarity score less or equal to 87%."""
-        soup_with_less_similarity = [x for x in html_soup if float(self.get_similarity_procent(x)) <= 87]
-        return [x for x in list(map(self.pack_links_and_similarity_from_result_to_tuple, soup_with_less_similarity)) if
-                len(x) > 1]
+        return [x.as_tuple() for x in table if x.similarity <= NAO_HIGH_SIMILARITY and x.links]
 
     def save_links_to_imageboards(self, imageboards: list, link: str) -> None:
         """Saves a URL to the parsed_links dictionary if it matches any of the given imageboard names."""
@@ -218,3 +275,120 @@ class NAOArtistParser:
             names += [self.get_artist_name(x) for x in artists_from_desc]
 
         return names
+
+
+class NAOJsonParser(SauseNaoParser):
+    """
+    Sauce NAO parser, which uses API of Sauce NAO (output_type=2) instead of html page.
+    Result of search is json with header and list of results, so nothing is parsed from markup:
+    methods of SauseNaoParser are overridden to take the same data from json,
+    output (parsed_links and artists) is the same as html parser gives.
+    Async searches wait for their turn in core.nao_scheduler, user_id is used to queue them fairly.
+    """
+    artist_fields: typing.ClassVar = ('member_name', 'creator', 'author_name')  # same as NAOArtistParser.filterlist
+
+    def __init__(self, file, session, parsed_links=None, user_id=None):
+        super(NAOJsonParser, self).__init__(file, session, parsed_links)
+        self.user_id = user_id
+
+    @staticmethod
+    def api_params(api_key: typing.Optional[str]) -> dict:
+        """Query parameters of API request. Search is restricted to indexes of registered imageboard parsers"""
+        params = {'output_type': 2, 'numres': NAO_RESULTS_COUNT, 'dbmask': NAO_DBMASK}
+        if api_key:
+            params['api_key'] = api_key
+        return params
+
+    @staticmethod
+    def check_response(response: req.Response | httpx.Response) -> dict:
+        """Returns json of API responce. Rises ErrorConnectToNAO if search failed"""
+        if response.status_code != 200:
+            raise ErrorConnectToNAO
+        try:
+            result = response.json()
+        except ValueError:
+            raise ErrorConnectToNAO
+        if result.get('header', {}).get('status', -1) < 0:  # negative status is error at Sauce NAO side
+            raise ErrorConnectToNAO
+        return result
+
+    def get_soup(self) -> dict:
+        """Sends search request to Sauce NAO API, when scheduler allows it, and returns json of result.
+        Search rejected because of limits or key is sent again with other key"""
+        for _ in range(NAO_RETRIES):
+            key = nao_scheduler.take_blocking()
+            try:
+                response = self.session.post(NAO_URL, params=self.api_params(key.api_key), files=self.search_files,
+                                             timeout=NAO_TIMEOUT)
+            except req.RequestException:
+                raise ErrorConnectToNAO
+            if response.status_code == 429:
+                nao_scheduler.limit_reached(key, long='daily' in response.text.lower())
+                continue
+            if response.status_code == 403:
+                nao_scheduler.rejected(key)
+                continue
+            result = self.check_response(response)
+            nao_scheduler.update(key, result['header'])
+            return result
+        raise ErrorConnectToNAO
+
+    async def async_get_soup(self) -> dict:
+        """Same as get_soup, but doesn't block event loop. Search is sent with key given by scheduler,
+        when scheduler allows it, and queued again if Sauce NAO rejects it because of limits or key"""
+        for _ in range(NAO_RETRIES):
+            key = await nao_scheduler.acquire(self.user_id)
+            try:
+                response = await self.session.post(NAO_URL, params=self.api_params(key.api_key),
+                                                   files=self.search_files, timeout=NAO_TIMEOUT)
+            except httpx.HTTPError:
+                raise ErrorConnectToNAO
+            if response.status_code == 429:  # 'Search Rate Too High' or 'Daily Search Limit Exceeded'
+                nao_scheduler.limit_reached(key, long='daily' in response.text.lower())
+                continue
+            if response.status_code == 403:  # invalid or banned key
+                nao_scheduler.rejected(key)
+                continue
+            result = self.check_response(response)
+            nao_scheduler.update(key, result['header'])
+            return result
+        raise ErrorConnectToNAO
+
+    @staticmethod
+    def get_redirection_link(result: dict) -> str:
+        """Builds link to Yandex search by the copy of searched picture, stored at Sauce NAO"""
+        picture = result['header'].get('query_image_display')
+        if not picture:
+            raise ErrorConnectToNAO
+        return f'{YANDEX_SEARCH_URL}?{urlencode({"rpt": "imageview", "url": f"{NAO_SITE}/{picture}"})}'
+
+    @staticmethod
+    def get_table(result: dict) -> list[dict]:
+        """Returns results of search, which Sauce NAO counts as relevant (on html page the rest is hidden)"""
+        minimum = float(result['header'].get('minimum_similarity', 0))
+        return [x for x in result.get('results') or [] if float(x['header']['similarity']) >= minimum]
+
+    @staticmethod
+    def get_similarity_procent(result: dict) -> str:
+        """get value of similarity (as a percentage) between result and searched image"""
+        return result['header']['similarity']
+
+    def artist_names(self, data: dict) -> list[str]:
+        """Returns artist's nicknames from single result. Creator may be list of names"""
+        names = []
+        for field_name in self.artist_fields:
+            value = data.get(field_name)
+            if isinstance(value, list):
+                names += [str(x) for x in value if x]
+            elif value:
+                names.append(str(value))
+        return names
+
+    def decode_result(self, result: dict) -> NaoResult:
+        """Takes the similarity score, all links and artists from a single search result"""
+        data = result['data']
+        links = list(data.get('ext_urls') or [])
+        if str(data.get('source', '')).startswith('http'):  # source is not always link
+            links.append(data['source'])
+        return NaoResult(float(self.get_similarity_procent(result)), links, result['header'].get('index_name'),
+                         self.artist_names(data))